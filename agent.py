@@ -3,12 +3,57 @@ from urllib.parse import urlparse
 import webbrowser
 from datetime import datetime
 import os
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from lmclient import make_client
+from cassette import cassette_active
+from scheduler import FOLLOW_UP
+from budget import BudgetController, TOOL_FOLLOW_UP
+from toolstream import ToolCallAssembler, parse_arguments
+from chatloop import ChatLoop
+import urlpolicy
 
 # Point to the local server
-client = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
+client = make_client()
 model = "huihui-ai_huihui-gpt-oss-20b-abliterated"
 
+# Learned max_tokens/stop budgets per turn type (see budget.py)
+BUDGET_STATE_PATH = "budget_state.json"
+generation_budget = BudgetController(BUDGET_STATE_PATH, frozen=cassette_active())
+generation_budget.report_at_exit()
+
+# Stream replies; tool calls then start as soon as their arguments are complete (see toolstream.py)
+STREAM = True
+tool_executor = ThreadPoolExecutor(max_workers=4)
+
+# Read input on its own thread so messages can be typed while a reply generates (see chatloop.py);
+# messages typed during one reply are merged into a single request. Ctrl-C cancels a reply.
+TYPE_AHEAD = True
+MERGE_QUEUED_MESSAGES = True
+
+# List of allowed domains (expand as needed). Subdomains are allowed too.
+SAFE_DOMAINS = {
+    "lmstudio.ai",
+    "github.com",
+    "google.com",
+    "wikipedia.org",
+    "weather.com",
+    "stackoverflow.com",
+    "python.org",
+    "docs.python.org",
+}
+
+# Optional allow/block list files (one domain per line), reloaded when they change
+ALLOWLIST_FILES = []
+BLOCKLIST_FILES = []
+URL_POLICY_CACHE = None  # e.g. "url_policy.cache" to memory-map large lists
+
+url_policy = urlpolicy.PolicyEngine(
+    allow=SAFE_DOMAINS,
+    allow_files=ALLOWLIST_FILES,
+    block_files=BLOCKLIST_FILES,
+    cache_path=URL_POLICY_CACHE,
+)
+
 
 def is_valid_url(url: str) -> bool:
 
@@ -20,18 +65,6 @@ def is_valid_url(url: str) -> bool:
 
 
 def open_safe_url(url: str) -> dict:
-    # List of allowed domains (expand as needed)
-    SAFE_DOMAINS = {
-        "lmstudio.ai",
-        "github.com",
-        "google.com",
-        "wikipedia.org",
-        "weather.com",
-        "stackoverflow.com",
-        "python.org",
-        "docs.python.org",
-    }
-
     try:
         # Add http:// if no scheme is present
         if not url.startswith(('http://', 'https://')):
@@ -41,14 +74,18 @@ def open_safe_url(url: str) -> dict:
         if not is_valid_url(url):
             return {"status": "error", "message": f"Invalid URL format: {url}"}
 
-        # Parse the URL and check domain
-        parsed_url = urlparse(url)
-        domain = parsed_url.netloc.lower()
-        base_domain = ".".join(domain.split(".")[-2:])
+        # Check the domain, and open only what was checked
+        checked = urlpolicy.checked_url(url)
+        if checked is None:
+            return {"status": "error", "message": f"Invalid URL format: {url}"}
+        domain, url = checked
+        decision = url_policy.decide(domain)
 
-        if base_domain in SAFE_DOMAINS:
+        if decision == urlpolicy.ALLOW:
             webbrowser.open(url)
             return {"status": "success", "message": f"Opened {url} in browser"}
+        elif decision == urlpolicy.BLOCK:
+            return {"status": "error", "message": f"Domain {domain} is blocked"}
         else:
             return {
                 "status": "error",
@@ -155,6 +192,30 @@ tools = [
 ]
 
 
+def execute_tool(name: str, arguments: dict):
+    """Run one tool, returning None for unknown tools"""
+    if name == "open_safe_url":
+        if "url" not in arguments:
+            return {"status": "error", "message": "Missing required argument: url"}
+        return open_safe_url(arguments["url"])
+    elif name == "get_current_time":
+        return get_current_time()
+    elif name == "analyze_directory":
+        return analyze_directory(arguments.get("path", "."))
+    return None
+
+
+def get_final_response(messages):
+    """Ask for the reply that follows the tool results"""
+    return generation_budget.create(
+        client,
+        TOOL_FOLLOW_UP,
+        model=model,
+        messages=messages,
+        priority=FOLLOW_UP,
+    )
+
+
 def process_tool_calls(response, messages):
     """Process multiple tool calls and return the final response and updated messages"""
     # Get all tool calls from the response
@@ -179,22 +240,13 @@ def process_tool_calls(response, messages):
     # Process each tool call and collect results
     tool_results = []
     for tool_call in tool_calls:
-        # For functions with no arguments, use empty dict
-        arguments = (
-            json.loads(tool_call.function.arguments)
-            if tool_call.function.arguments.strip()
-            else {}
-        )
-
-        # Determine which function to call based on the tool call name
-        if tool_call.function.name == "open_safe_url":
-            result = open_safe_url(arguments["url"])
-        elif tool_call.function.name == "get_current_time":
-            result = get_current_time()
-        elif tool_call.function.name == "analyze_directory":
-            path = arguments.get("path", ".")
-            result = analyze_directory(path)
+        # For functions with no arguments, use empty dict; malformed JSON becomes an error result
+        arguments, error = parse_arguments(tool_call.function.arguments)
+        if error is not None:
+            result = {"status": "error", "message": error}
         else:
+            result = execute_tool(tool_call.function.name, arguments)
+        if result is None:
             # llm tried to call a function that doesn't exist, skip
             continue
 
@@ -208,12 +260,60 @@ def process_tool_calls(response, messages):
         messages.append(tool_result_message)
 
     # Get the final response
-    final_response = client.chat.completions.create(
+    return get_final_response(messages)
+
+
+def stream_reply(messages):
+    """Stream a reply, printing its text and running tool calls as soon as they are complete.
+
+    Returns (content, final_response); final_response is None when the reply had no tool calls.
+    """
+    stream = client.chat.completions.create(
         model=model,
         messages=messages,
+        tools=tools,
+        stream=True,
     )
-
-    return final_response
+    assembler = ToolCallAssembler(execute_tool, tool_executor)
+    content = []
+    printed = False
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.tool_calls:
+            assembler.feed(delta.tool_calls)
+        if delta.content:
+            if not printed:
+                print("\nAssistant: ", end="", flush=True)
+                printed = True
+            print(delta.content, end="", flush=True)
+            content.append(delta.content)
+    if printed:
+        print()
+
+    results = assembler.results()
+    if not results:
+        return "".join(content), None
+
+    messages.append(
+        {
+            "role": "assistant",
+            "content": "".join(content) or None,
+            "tool_calls": [call.as_message() for call, _ in results],
+        }
+    )
+    for call, result in results:
+        if result is None:
+            continue
+        messages.append(
+            {
+                "role": "tool",
+                "content": json.dumps(result),
+                "tool_call_id": call.id,
+            }
+        )
+    return "".join(content), get_final_response(messages)
 
 
 def chat():
@@ -229,19 +329,19 @@ def chat():
     )
     print("(Type 'quit' to exit)")
 
-    while True:
-        # Get user input
-        user_input = input("\nYou: ").strip()
-
-        # Check for quit command
-        if user_input.lower() == "quit":
-            print("Assistant: Goodbye!")
-            break
-
+    def respond(messages, user_input):
         # Add user message to conversation
         messages.append({"role": "user", "content": user_input})
 
         try:
+            if STREAM:
+                content, final_response = stream_reply(messages)
+                if final_response is not None:
+                    content = final_response.choices[0].message.content
+                    print("\nAssistant:", content)
+                messages.append({"role": "assistant", "content": content})
+                return
+
             # Get initial response
             response = client.chat.completions.create(
                 model=model,
@@ -278,6 +378,9 @@ def chat():
             print(f"\nAn error occurred: {str(e)}")
             exit(1)
 
+    ChatLoop(lambda: "\nYou: ", type_ahead=TYPE_AHEAD, merge=MERGE_QUEUED_MESSAGES).run(messages, respond)
+    print("Assistant: Goodbye!")
+
 
 if __name__ == "__main__":
     chat()
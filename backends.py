@@ -0,0 +1,345 @@
+"""A pool of LM Studio servers shared by the chat scripts.
+
+When LMSTUDIO_BACKENDS points at a YAML file (or backends.yaml exists in the
+working directory) lmclient routes every request through a BackendPool
+instead of a single base_url:
+
+    backends:
+      - name: desk
+        base_url: http://localhost:1234/v1
+        models: [qwen3-8b, unfilteredai_dan-qwen3-1.7b]
+      - name: laptop
+        base_url: http://192.168.1.20:1234/v1
+        models: [qwen3-8b]
+    health_check_interval: 10   # seconds between GET /models probes
+    max_failures: 3             # consecutive failures before a backend is evicted
+    eviction_seconds: 30        # how long an evicted backend is skipped
+
+A request goes to a healthy backend that has the requested model loaded and
+the fewest requests outstanding. A session keeps using the same backend
+while it stays healthy so the server's prompt cache keeps hitting. A backend
+with no models listed serves whatever its /models endpoint reports.
+
+    python backends.py --mock 3   # exercise the pool against local mock servers
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import yaml
+from openai import OpenAI
+
+from scheduler import HeldStream
+
+DEFAULT_CONFIG_PATH = "backends.yaml"
+
+
+class Backend:
+    def __init__(self, name: str, base_url: str, models: List[str] = (), api_key: str = "lm-studio"):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.models = set(models)
+        self.discovered_models = set()
+        self.client = OpenAI(base_url=self.base_url, api_key=api_key, max_retries=0)  # the pool retries elsewhere
+        self.outstanding = 0
+        self.failures = 0
+        self.evicted_until = 0.0
+        self.probe_failures = 0  # kept apart so a probe that answers does not end an eviction caused by requests
+        self.probe_evicted_until = 0.0
+        self.served = 0
+
+    def serves(self, model: str) -> bool:
+        return model in (self.models or self.discovered_models)
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.evicted_until and now >= self.probe_evicted_until
+
+
+class BackendPool:
+    """Routes completions by model, least outstanding requests and session affinity."""
+
+    def __init__(
+        self,
+        backends: List[Backend],
+        health_check_interval: float = 10.0,
+        max_failures: int = 3,
+        eviction_seconds: float = 30.0,
+    ):
+        if not backends:
+            raise ValueError("A backend pool needs at least one backend")
+        self.backends = backends
+        self.health_check_interval = health_check_interval
+        self.max_failures = max_failures
+        self.eviction_seconds = eviction_seconds
+        self._lock = threading.Lock()
+        self._affinity: Dict[tuple, Backend] = {}
+        self._stop = threading.Event()
+        # Probe once up front so backends without a models list can serve the first request
+        with ThreadPoolExecutor(max_workers=len(backends)) as executor:
+            list(executor.map(self.check, backends))
+        if health_check_interval > 0:
+            threading.Thread(target=self._health_loop, daemon=True).start()
+
+    @classmethod
+    def from_config(cls, path: str):
+        with open(path, "r") as file:
+            config = yaml.safe_load(file)
+        backends = [
+            Backend(b.get("name", b["base_url"]), b["base_url"], b.get("models") or [], b.get("api_key", "lm-studio"))
+            for b in config["backends"]
+        ]
+        return cls(
+            backends,
+            health_check_interval=config.get("health_check_interval", 10.0),
+            max_failures=config.get("max_failures", 3),
+            eviction_seconds=config.get("eviction_seconds", 30.0),
+        )
+
+    def pick(self, model: str, session: str, exclude=()) -> Backend:
+        """Choose a backend for this model and session and count the request as outstanding."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                b for b in self.backends
+                if b not in exclude and b.healthy(now) and b.serves(model)
+            ]
+            if not candidates:
+                raise RuntimeError(f"No healthy backend has model '{model}' loaded")
+
+            backend = self._affinity.get((session, model))
+            if backend not in candidates:
+                backend = min(candidates, key=lambda b: b.outstanding)
+                self._affinity[(session, model)] = backend
+            backend.outstanding += 1
+            backend.served += 1
+            return backend
+
+    def _done(self, backend: Backend, ok: Optional[bool]) -> None:
+        """Finish an outstanding request; ok=None (e.g. cancelled) says nothing about the backend's health."""
+        with self._lock:
+            backend.outstanding -= 1
+            if ok:
+                backend.failures = 0
+            elif ok is not None:
+                backend.failures += 1
+                if backend.failures >= self.max_failures:
+                    backend.evicted_until = self._evict(backend, backend.failures, "failures")
+
+    def _evict(self, backend: Backend, failures: int, what: str) -> float:
+        print(f"[backends] Evicting '{backend.name}' for {self.eviction_seconds:.0f}s after {failures} {what}")
+        return time.monotonic() + self.eviction_seconds
+
+    def create(self, session: str, **kwargs):
+        """Send a chat completion, retrying on another backend if this one fails."""
+        model = kwargs.get("model")
+        tried = []
+        last_error = None
+        while True:
+            try:
+                backend = self.pick(model, session, exclude=tried)
+            except RuntimeError:
+                if last_error is not None:
+                    raise last_error
+                raise
+            try:
+                response = backend.client.chat.completions.create(**kwargs)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    # Interrupted (e.g. Ctrl-C cancelling a turn): not the backend's fault, but no longer outstanding
+                    self._done(backend, ok=None)
+                    raise
+                # 4xx errors are about the request, not the backend
+                server_fault = getattr(e, "status_code", 500) >= 500
+                self._done(backend, ok=not server_fault)
+                if not server_fault:
+                    raise
+                tried.append(backend)
+                last_error = e
+                continue
+
+            if kwargs.get("stream"):
+                outcome = {"ok": None}  # closed before the end (e.g. a cancelled turn) says nothing about the backend
+                return HeldStream(_watch_stream(response, outcome), lambda: self._done(backend, outcome["ok"]))
+            self._done(backend, ok=True)
+            return response
+
+    def check(self, backend: Backend) -> bool:
+        """Probe GET /models, refresh the discovered model list and update health.
+
+        Probe failures evict a backend on their own; a successful probe only
+        clears those, since /models can answer while completions keep failing.
+        """
+        try:
+            with urllib.request.urlopen(backend.base_url + "/models", timeout=2) as resp:
+                data = json.loads(resp.read())
+            models = {m["id"] for m in data.get("data", [])}
+        except Exception:
+            with self._lock:
+                backend.probe_failures += 1
+                if backend.probe_failures >= self.max_failures:
+                    backend.probe_evicted_until = self._evict(backend, backend.probe_failures, "failed probes")
+            return False
+        with self._lock:
+            backend.discovered_models = models
+            backend.probe_failures = 0
+            backend.probe_evicted_until = 0.0
+        return True
+
+    def _health_loop(self) -> None:
+        while not self._stop.wait(self.health_check_interval):
+            for backend in self.backends:
+                self.check(backend)
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def status(self) -> List[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "name": b.name,
+                    "healthy": b.healthy(now),
+                    "outstanding": b.outstanding,
+                    "served": b.served,
+                    "failures": b.failures,
+                    "probe_failures": b.probe_failures,
+                    "models": sorted(b.models or b.discovered_models),
+                }
+                for b in self.backends
+            ]
+
+
+def _watch_stream(stream, outcome: dict):
+    """Yield a streamed response, noting in outcome["ok"] whether it ran to the end or failed mid-stream."""
+    try:
+        for chunk in stream:
+            yield chunk
+    except Exception:
+        outcome["ok"] = False  # e.g. the connection dropped mid-stream
+        raise
+    finally:
+        if hasattr(stream, "close"):
+            stream.close()
+    outcome["ok"] = True
+
+
+class PoolClient:
+    """Client-shaped view of a BackendPool for one session."""
+
+    def __init__(self, pool: BackendPool, session: str):
+        self.pool = pool
+        self.session = session
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=lambda **kw: pool.create(session, **kw)))
+
+
+def load_pool(path: Optional[str] = None) -> Optional[BackendPool]:
+    """Build the pool from LMSTUDIO_BACKENDS or backends.yaml, or return None if neither exists."""
+    path = path or os.environ.get("LMSTUDIO_BACKENDS") or DEFAULT_CONFIG_PATH
+    if not os.path.exists(path):
+        return None
+    return BackendPool.from_config(path)
+
+
+def _mock_server(models: List[str], delay: float):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, payload: dict) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._send({"object": "list", "data": [{"id": m, "object": "model"} for m in models]})
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(delay)
+            self._send({
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": f"mock reply from port {self.server.server_port}"},
+                }],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 4, "total_tokens": 5},
+            })
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_mock(count: int, requests: int) -> None:
+    """Start mock servers on local ports, send traffic through a pool and stop one halfway."""
+    servers = [_mock_server(["qwen3-8b", "small"] if i % 2 == 0 else ["qwen3-8b"], delay=0.05) for i in range(count)]
+    pool = BackendPool(
+        [Backend(f"mock{i}", f"http://127.0.0.1:{s.server_port}/v1") for i, s in enumerate(servers)],
+        health_check_interval=0.5,
+        max_failures=1,
+        eviction_seconds=5,
+    )
+
+    def send(i):
+        model = "small" if i % 5 == 0 else "qwen3-8b"
+        session = f"session{i % 4}"
+        reply = PoolClient(pool, session).chat.completions.create(
+            model=model, messages=[{"role": "user", "content": "ping"}]
+        )
+        return session, model, reply.choices[0].message.content
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        first = list(executor.map(send, range(requests // 2)))
+        servers[0].shutdown()
+        servers[0].server_close()
+        print(f"Stopped mock0 after {len(first)} requests")
+        second = list(executor.map(send, range(requests // 2, requests)))
+
+    for label, results in (("before", first), ("after", second)):
+        affinity = {}
+        for session, model, reply in results:
+            affinity.setdefault((session, model), set()).add(reply.rsplit(" ", 1)[1])
+        print(f"Ports per (session, model) {label} the outage: {dict(sorted(affinity.items()))}")
+    for row in pool.status():
+        print(row)
+    pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LM Studio backend pool")
+    parser.add_argument("--config", help="Pool config file (default LMSTUDIO_BACKENDS or backends.yaml)")
+    parser.add_argument("--mock", type=int, metavar="N", help="Run against N local mock servers")
+    parser.add_argument("--requests", type=int, default=40, help="Requests to send in mock mode")
+    args = parser.parse_args()
+
+    if args.mock:
+        run_mock(args.mock, args.requests)
+        return
+
+    pool = load_pool(args.config)
+    if pool is None:
+        print("No pool config found")
+        return
+    for backend in pool.backends:
+        pool.check(backend)
+    for row in pool.status():
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
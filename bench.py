@@ -0,0 +1,279 @@
+"""Offline micro-benchmarks for the agent hot paths.
+
+Every case runs against synthetic fixtures and a stubbed client, so no LM
+Studio server is needed. Results are compared with a saved baseline and any
+case that got slower than the threshold is reported as a regression.
+
+    python bench.py --save          # record bench_baseline.json
+    python bench.py                 # compare against it (exit code 1 on regression)
+    python bench.py --quick -k switch
+"""
+import argparse
+import builtins
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+# The scripts set up their clients and learned state at import. Keep that offline and away from the
+# user's files: no backend pool (the path below does not exist), no cassette, and a working directory
+# without budget_state.json/router_state.json.
+_IMPORT_DIR = tempfile.mkdtemp(prefix="bench-")
+os.environ["LMSTUDIO_BACKENDS"] = os.path.join(_IMPORT_DIR, "backends.yaml")
+os.environ.pop("LMSTUDIO_CASSETTE", None)
+_cwd = os.getcwd()
+os.chdir(_IMPORT_DIR)
+try:
+    import agent
+    import multi
+    import thejeff
+finally:
+    os.chdir(_cwd)
+    shutil.rmtree(_IMPORT_DIR, ignore_errors=True)
+
+BASELINE_PATH = "bench_baseline.json"
+DEFAULT_THRESHOLD = 0.20  # flag cases more than 20% slower than the baseline
+
+
+class StubCompletions:
+    """Stand-in for client.chat.completions that answers from a list of canned replies."""
+
+    def __init__(self, replies=None):
+        self.replies = list(replies or ["Sure, here you go."])
+        self.calls = 0
+
+    def create(self, **kwargs):
+        reply = self.replies[self.calls % len(self.replies)]
+        self.calls += 1
+        if isinstance(reply, list):
+            return make_response(tool_calls=reply)
+        return make_response(content=reply)
+
+
+class StubClient:
+    def __init__(self, replies=None):
+        self.chat = SimpleNamespace(completions=StubCompletions(replies))
+
+
+def make_tool_call(index: int, name: str, arguments: str):
+    return SimpleNamespace(
+        id=f"call_{index}",
+        type="function",
+        function=SimpleNamespace(name=name, arguments=arguments),
+    )
+
+
+def make_response(content=None, tool_calls=None):
+    message = SimpleNamespace(role="assistant", content=content, tool_calls=tool_calls)
+    usage = SimpleNamespace(prompt_tokens=0, completion_tokens=len(content or "") // 4, total_tokens=0)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+        usage=usage,
+    )
+
+
+def build_directory_tree(root: str, dirs: int, files_per_dir: int, depth: int) -> None:
+    """Create dirs top-level folders, each a chain of depth folders holding files_per_dir files."""
+    extensions = [".py", ".txt", ".md", ".json", ""]
+    for d in range(dirs):
+        path = os.path.join(root, f"dir{d}")
+        for level in range(depth):
+            path = os.path.join(path, f"level{level}")
+            os.makedirs(path, exist_ok=True)
+            for f in range(files_per_dir):
+                with open(os.path.join(path, f"file{f}{extensions[f % len(extensions)]}"), "wb") as file:
+                    file.write(b"x" * (f % 64))
+    for f in range(files_per_dir):
+        with open(os.path.join(root, f"top{f}{extensions[f % len(extensions)]}"), "wb") as file:
+            file.write(b"y" * f)
+
+
+def make_roster(count: int) -> list:
+    return [
+        {
+            "name": f"Player{i}",
+            "alien_skill": "Telekinesis",
+            "mundane_skills": ["Lockpicking", "Stealth", "Persuasion"],
+            "primary_goal": f"Steal artifact {i}",
+            "secondary_goal": "Avoid detection",
+            "tertiary_goal": "Help the Homeward faction",
+            "faction": "Homeward" if i % 2 else "Earthbound",
+        }
+        for i in range(count)
+    ]
+
+
+@contextlib.contextmanager
+def patched(obj, name, value):
+    original = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, original)
+
+
+def case_should_switch_model(scale: int):
+    benign = "Here is a detailed explanation of the topic you asked about. " * (40 * scale)
+    refusal = benign + "However, I cannot provide instructions for that."
+    many_triggers = multi.COMPILED_TRIGGERS + [
+        multi.re.compile(rf"\bsynthetic trigger number {i}\b", multi.re.I) for i in range(200)
+    ]
+
+    def run():
+        with patched(multi, "COMPILED_TRIGGERS", many_triggers):
+            for _ in range(10):
+                multi.should_switch_model(benign)
+                multi.should_switch_model(refusal)
+
+    return run, None
+
+
+def case_analyze_directory(scale: int):
+    root = tempfile.mkdtemp(prefix="bench_tree_")
+    build_directory_tree(root, dirs=10 * scale, files_per_dir=50, depth=4)
+
+    def run():
+        agent.analyze_directory(root)
+        multi.analyse_directory(root)
+
+    return run, lambda: shutil.rmtree(root, ignore_errors=True)
+
+
+def case_multi_chat_history(scale: int):
+    turns = 100 * scale
+    answer = "A reasonably long assistant answer that pads the history. " * 20
+
+    def run():
+        feed = iter([f"Question number {i}?" for i in range(turns)] + ["quit"])
+        with patched(multi, "client", StubClient([answer])), \
+                patched(multi, "router", multi.ModelRouter(multi.MODEL_CASCADE)), \
+                patched(multi, "generation_budget", multi.BudgetController()), \
+                patched(multi, "TYPE_AHEAD", False), \
+                patched(builtins, "input", lambda prompt="": next(feed)), \
+                contextlib.redirect_stdout(io.StringIO()):
+            multi.chat()
+
+    return run, None
+
+
+def case_get_system_prompt(scale: int):
+    roster = make_roster(200 * scale)
+
+    def run():
+        with patched(thejeff, "game_state", dict(thejeff.game_state, players=roster, current_player="Player0")):
+            for _ in range(20):
+                thejeff.get_system_prompt() + "\n\n" + thejeff.get_player_secrets()
+
+    return run, None
+
+
+def case_tool_arguments(scale: int):
+    payload = json.dumps({"path": ".", "padding": ["value"] * 200, "nested": {"k": list(range(100))}})
+    calls = [make_tool_call(i, "unknown_tool", payload) for i in range(100 * scale)]
+    calls += [make_tool_call(len(calls) + i, "get_current_time", "") for i in range(10)]
+    response = make_response(tool_calls=calls)
+
+    def run():
+        with patched(agent, "client", StubClient()), patched(multi, "client", StubClient()), \
+                patched(agent, "generation_budget", agent.BudgetController()), \
+                patched(multi, "generation_budget", multi.BudgetController()):
+            agent.process_tool_calls(response, [])
+            multi.process_tool_calls(response, [], multi.DEFAULT_MODEL)
+
+    return run, None
+
+
+CASES = {
+    "should_switch_model": case_should_switch_model,
+    "analyze_directory": case_analyze_directory,
+    "multi_chat_history": case_multi_chat_history,
+    "get_system_prompt": case_get_system_prompt,
+    "tool_argument_json": case_tool_arguments,
+}
+
+
+def time_case(run, repeat: int) -> dict:
+    run()  # warm up caches and lazy imports
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"min_ms": min(samples), "median_ms": statistics.median(samples), "repeat": repeat}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Return (name, baseline_ms, current_ms, ratio) for every case slower than the threshold."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]["min_ms"]
+        new = result["min_ms"]
+        if old > 0 and new > old * (1 + threshold):
+            regressions.append((name, old, new, new / old))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks for the agent hot paths")
+    parser.add_argument("-k", dest="pattern", default="", help="Only run cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case")
+    parser.add_argument("--quick", action="store_true", help="Use smaller fixtures")
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file to read or write")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed slowdown (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    scale = 1 if args.quick else 4
+    results = {}
+    for name, factory in CASES.items():
+        if args.pattern not in name:
+            continue
+        run, cleanup = factory(scale)
+        try:
+            results[name] = time_case(run, args.repeat)
+        finally:
+            if cleanup:
+                cleanup()
+        results[name]["scale"] = scale
+        print(f"{name:<22} min {results[name]['min_ms']:9.2f} ms   median {results[name]['median_ms']:9.2f} ms")
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r") as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save to create one")
+        return
+
+    with open(args.baseline, "r") as file:
+        baseline = json.load(file)
+    comparable = {name: r for name, r in results.items() if baseline.get(name, {}).get("scale") == scale}
+    regressions = compare(comparable, baseline, args.threshold)
+    if not regressions:
+        print(f"\nNo regressions beyond {args.threshold:.0%}")
+        return
+
+    print(f"\nRegressions beyond {args.threshold:.0%}:")
+    for name, old, new, ratio in regressions:
+        print(f"  {name}: {old:.2f} ms -> {new:.2f} ms ({ratio:.2f}x)")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
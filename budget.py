@@ -0,0 +1,246 @@
+"""Per-turn generation budgets: max_tokens and stop sequences by turn type.
+
+Each completion is tagged with a turn type. Until a type/model pair has
+WARMUP_SAMPLES observations it runs with the generous ceiling from
+DEFAULT_BUDGETS; after that its max_tokens is the 95th percentile of the
+observed answer lengths plus HEADROOM, plus the 95th percentile of the
+reasoning the model spent before answering. If more than TARGET_TRUNCATION
+of recent replies hit the limit, the budget is raised again. Replies that
+only call tools are not observed, since their length says nothing about
+the answer.
+
+A reply that was cut off while still reasoning has no answer at all, so
+create() retries it once: at the ceiling if the budget was lower, otherwise
+as a fast (/no_think) turn.
+
+Time saved is estimated from the warm-up sample: when a reply is cut off at
+budget b, the tokens it would have produced are taken as the mean of the
+warm-up lengths above b, converted to seconds at the observed generation
+speed.
+
+The state file can be shared by scripts running at the same time: each save
+merges this process's entries into what is on disk (see statefile.py).
+
+A frozen controller (used while a cassette records or replays) always
+returns the ceilings and learns nothing, so requests are the same every run.
+
+    LMSTUDIO_BUDGET_REPORT   print the per-type report at exit when set
+"""
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from reasoning import no_think, strip_reasoning
+from statefile import update_json
+
+TOOL_FOLLOW_UP = "tool_follow_up"
+NARRATION = "narration"
+CHAOS = "chaos"
+OPENING = "opening"
+PRIVATE_NARRATION = "private_narration"
+
+# Ceilings used during warm-up and as hard caps afterwards (tokens, reasoning included)
+DEFAULT_BUDGETS = {
+    TOOL_FOLLOW_UP: 1024,
+    NARRATION: 1536,
+    CHAOS: 1536,
+    OPENING: 2048,
+    PRIVATE_NARRATION: 1024,
+}
+MIN_BUDGET = 64
+WARMUP_SAMPLES = 20
+WINDOW = 200  # recent lengths kept per type/model
+HEADROOM = 1.25
+TARGET_TRUNCATION = 0.10
+
+# Stop sequences per type; callers can add their own (e.g. a player's name prompt)
+STOP_SEQUENCES = {
+    TOOL_FOLLOW_UP: [],
+    NARRATION: ["\nUSER:", "\nPLAYER:"],
+    CHAOS: ["\nUSER:", "\nPLAYER:"],
+    OPENING: ["\nUSER:", "\nPLAYER:"],
+    PRIVATE_NARRATION: ["\nUSER:", "\nPLAYER:"],
+}
+MAX_STOP_SEQUENCES = 4  # the OpenAI API accepts at most four
+
+
+def percentile(values, q: float) -> float:
+    """Nearest-rank percentile (q in 0..1) of a non-empty sequence."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+
+def _cut_off_while_reasoning(response) -> bool:
+    """Whether a reply hit max_tokens before producing any visible answer or tool call."""
+    try:
+        choice = response.choices[0]
+        return (choice.finish_reason == "length" and not getattr(choice.message, "tool_calls", None)
+                and not strip_reasoning(choice.message.content)[0])
+    except (AttributeError, IndexError, TypeError):
+        return False
+
+
+class BudgetController:
+    """Assigns max_tokens/stop per turn type and learns budgets from observed replies."""
+
+    def __init__(self, path: Optional[str] = None, frozen: bool = False):
+        self.path = None if frozen else path
+        self.frozen = frozen
+        self.state: Dict[str, dict] = {}
+        self._dirty = set()  # entries this process has updated; the rest follow the file
+        self._lock = threading.RLock()  # private views observe from several threads at once
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(path, "r") as file:
+                    self.state = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"[budget] Ignoring unreadable state file {path}: {e}")
+
+    def _entry(self, turn_type: str, model: str) -> dict:
+        key = f"{turn_type}|{model}"
+        if key not in self.state:
+            self.state[key] = {
+                "warmup": [],
+                "recent": [],
+                "reasoning_recent": [],
+                "truncated_recent": [],
+                "responses": 0,
+                "truncated": 0,
+                "tokens_per_s": None,
+                "saved_tokens": 0.0,
+                "saved_s": 0.0,
+            }
+        return self.state[key]
+
+    def max_tokens(self, turn_type: str, model: str) -> int:
+        ceiling = DEFAULT_BUDGETS[turn_type]
+        if self.frozen:
+            return ceiling
+        with self._lock:
+            entry = self._entry(turn_type, model)
+            if len(entry["warmup"]) < WARMUP_SAMPLES:
+                return ceiling
+            budget = percentile(entry["recent"] or entry["warmup"], 0.95) * HEADROOM
+            if entry.get("reasoning_recent"):
+                budget += percentile(entry["reasoning_recent"], 0.95)
+            recent_truncated = entry["truncated_recent"][-WARMUP_SAMPLES:]
+        if recent_truncated and sum(recent_truncated) / len(recent_truncated) > TARGET_TRUNCATION:
+            budget *= 1.5
+        return int(max(MIN_BUDGET, min(ceiling, budget)))
+
+    def params(self, turn_type: str, model: str, stop: Iterable[str] = ()) -> dict:
+        """Keyword arguments to add to chat.completions.create for this turn."""
+        stops = (list(stop) + STOP_SEQUENCES.get(turn_type, []))[:MAX_STOP_SEQUENCES]
+        params = {"max_tokens": self.max_tokens(turn_type, model)}
+        if stops:
+            params["stop"] = stops
+        return params
+
+    def observe(self, turn_type: str, model: str, response, elapsed: float, max_tokens: int) -> None:
+        """Record a finished (non-streamed) reply's answer length, truncation and speed."""
+        if self.frozen:
+            return
+        try:
+            choice = response.choices[0]
+            finish_reason = choice.finish_reason
+            if finish_reason == "tool_calls" or getattr(choice.message, "tool_calls", None):
+                return
+            content = choice.message.content or ""
+            usage = getattr(response, "usage", None)
+            tokens = usage.completion_tokens if usage and usage.completion_tokens else len(content) // 4
+        except (AttributeError, IndexError, TypeError):
+            return
+        # Split the count between reasoning and answer in proportion to their text
+        answer, _ = strip_reasoning(content)
+        answer_tokens = round(tokens * len(answer) / len(content)) if content else tokens
+        with self._lock:
+            self._record(turn_type, model, finish_reason, tokens, answer_tokens, elapsed, max_tokens)
+            self.save()
+
+    def _record(self, turn_type: str, model: str, finish_reason, tokens: int, answer_tokens: int,
+                elapsed: float, max_tokens: int) -> None:
+        entry = self._entry(turn_type, model)
+        self._dirty.add(f"{turn_type}|{model}")
+        truncated = finish_reason == "length"
+        entry["responses"] += 1
+        entry["truncated"] += int(truncated)
+        entry["truncated_recent"] = (entry["truncated_recent"] + [int(truncated)])[-WINDOW:]
+        # Cut off while reasoning: the answer's length is unknown, only the reasoning's lower bound
+        if answer_tokens or not truncated:
+            if len(entry["warmup"]) < WARMUP_SAMPLES:
+                entry["warmup"].append(answer_tokens)
+            entry["recent"] = (entry["recent"] + [answer_tokens])[-WINDOW:]
+        reasoning_tokens = tokens - answer_tokens
+        if reasoning_tokens > 0 or entry.get("reasoning_recent"):
+            entry["reasoning_recent"] = (entry.get("reasoning_recent", []) + [reasoning_tokens])[-WINDOW:]
+
+        if elapsed > 0 and tokens:
+            tps = tokens / elapsed
+            entry["tokens_per_s"] = tps if entry["tokens_per_s"] is None else 0.8 * entry["tokens_per_s"] + 0.2 * tps
+
+        if truncated:
+            answer_budget = max_tokens - reasoning_tokens
+            longer = [n for n in entry["warmup"] if n > answer_budget]
+            if longer and entry["tokens_per_s"]:
+                saved = sum(longer) / len(longer) - answer_budget
+                entry["saved_tokens"] += saved
+                entry["saved_s"] += saved / entry["tokens_per_s"]
+
+    def create(self, client, turn_type: str, stop: Iterable[str] = (), **kwargs):
+        """Call client.chat.completions.create with this turn's budget and record the result."""
+        params = self.params(turn_type, kwargs["model"], stop)
+        started = time.perf_counter()
+        response = client.chat.completions.create(**params, **kwargs)
+        if kwargs.get("stream"):
+            return response
+        self.observe(turn_type, kwargs["model"], response, time.perf_counter() - started, params["max_tokens"])
+
+        if _cut_off_while_reasoning(response):
+            ceiling = DEFAULT_BUDGETS[turn_type]
+            if params["max_tokens"] < ceiling:
+                params["max_tokens"] = ceiling
+                how = f"at the {ceiling}-token ceiling"
+            elif no_think(kwargs["messages"]) != kwargs["messages"]:
+                kwargs["messages"] = no_think(kwargs["messages"])
+                how = "as a fast turn"
+            else:
+                return response
+            print(f"[budget] {turn_type} reply was cut off while reasoning; retrying {how}")
+            started = time.perf_counter()
+            response = client.chat.completions.create(**params, **kwargs)
+            self.observe(turn_type, kwargs["model"], response, time.perf_counter() - started, params["max_tokens"])
+        return response
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            def merge(on_disk):
+                return dict(on_disk, **{key: self.state[key] for key in self._dirty})
+
+            saved = update_json(self.path, merge)
+            # Pick up what other scripts learned for the entries this one has not touched
+            self.state.update({key: entry for key, entry in saved.items() if key not in self._dirty})
+
+    def report(self) -> str:
+        lines = ["[budget] type|model: budget, truncation rate, estimated tokens/time saved"]
+        with self._lock:
+            items = sorted(self.state.items())
+        for key, entry in items:
+            if not entry["responses"]:
+                continue
+            turn_type, model = key.split("|", 1)
+            lines.append(
+                f"  {key}: {self.max_tokens(turn_type, model)} tokens, "
+                f"{entry['truncated'] / entry['responses']:.0%} of {entry['responses']} truncated, "
+                f"~{entry['saved_tokens']:.0f} tokens / {entry['saved_s']:.1f}s saved"
+            )
+        return "\n".join(lines)
+
+    def report_at_exit(self) -> None:
+        if os.environ.get("LMSTUDIO_BUDGET_REPORT"):
+            atexit.register(lambda: print(self.report()))
@@ -0,0 +1,388 @@
+"""Record and replay chat.completions traffic.
+
+In record mode every chat.completions.create call is forwarded to the real
+client and the request, the response (or every streamed chunk) and the
+timings are appended to a cassette file. In replay mode responses are served
+from the cassette by request hash, either with the recorded latency or
+immediately, so a session can be repeated exactly without LM Studio running.
+
+The cassette is a sequence of zlib-compressed JSON records followed by an
+index of request hash -> record offsets, so replay only decompresses the
+records it needs. Recording into an existing cassette appends to it and
+rewrites the index as it goes, so an interrupted recording keeps every
+earlier session.
+
+Enable it for any script through lmclient with environment variables:
+
+    LMSTUDIO_CASSETTE=session.cassette LMSTUDIO_CASSETTE_MODE=record python multi.py
+    LMSTUDIO_CASSETTE=session.cassette LMSTUDIO_CASSETTE_LATENCY=zero python multi.py
+    python cassette.py session.cassette
+
+Requests are matched by a hash of all their arguments, so anything that
+changes them between runs would break replay. While a cassette is active
+(record or replay) the scripts therefore freeze their learned policies: the
+model router keeps the configured cascade order and learns nothing, and the
+generation budgets stay at their DEFAULT_BUDGETS ceilings without reading or
+writing the state file. lmclient also seeds `random` with CASSETTE_SEED, so
+dice rolls and the starting player come out the same. Speculative decoding
+sits below the cassette, so a draft model the server rejected while
+recording does not change the replayed requests either.
+
+Some inputs still differ between runs, such as the current time or a
+directory listing returned by a tool, and every request after them in a
+tool loop hashes differently. On a hash miss replay therefore retries with
+the content of `role == "tool"` messages left out of the hash, and serves
+the matching records in recorded order; any other difference raises
+CassetteMiss. LMSTUDIO_CASSETTE_MATCH=order loosens this further to serve
+the next unused record with the same model and stream flag, whatever the
+prompt (preferring one whose last message matches, so concurrent private
+views keep their own replies).
+"""
+import atexit
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+_MAGIC = b"LMCASS1\n"
+_FOOTER = struct.Struct("<Q8s")  # index offset, end magic
+_END = b"LMCIDX1\n"
+_LENGTH = struct.Struct("<I")
+_FALLBACK_WINDOW = 16  # unused records examined after a hash miss in "order" match mode
+_INDEX_EVERY = 8  # records appended between index rewrites while recording
+
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def cassette_active() -> bool:
+    """Whether lmclient records to or replays from a cassette (LMSTUDIO_CASSETTE is set)."""
+    return bool(os.environ.get("LMSTUDIO_CASSETTE"))
+
+
+def to_plain(obj):
+    """Convert SDK response objects, namespaces and containers into JSON-compatible data."""
+    if hasattr(obj, "model_dump"):
+        return to_plain(obj.model_dump())
+    if isinstance(obj, SimpleNamespace):
+        return {k: to_plain(v) for k, v in vars(obj).items()}
+    if isinstance(obj, dict):
+        return {str(k): to_plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_plain(v) for v in obj]
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    return str(obj)
+
+
+def to_attrs(data):
+    """Turn recorded JSON back into objects with attribute access, like the SDK types."""
+    if isinstance(data, dict):
+        return SimpleNamespace(**{k: to_attrs(v) for k, v in data.items()})
+    if isinstance(data, list):
+        return [to_attrs(v) for v in data]
+    return data
+
+
+def request_key(kwargs: dict) -> str:
+    """Stable hash of a create() call's keyword arguments."""
+    canonical = json.dumps(to_plain(kwargs), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def tool_agnostic_key(kwargs: dict) -> str:
+    """Hash of a create() call with the content of tool results left out."""
+    plain = to_plain(kwargs)
+    messages = plain.get("messages")
+    if isinstance(messages, list):
+        plain["messages"] = [
+            {**message, "content": None} if isinstance(message, dict) and message.get("role") == "tool" else message
+            for message in messages
+        ]
+    return request_key(plain)
+
+
+class Cassette:
+    """An indexed cassette file.
+
+    Records are appended past the current footer, which stays valid until a
+    new index and footer are written after them, every _INDEX_EVERY records
+    and on close. A cassette whose recording was cut off before that is
+    recovered by walking its records.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._data_end = len(_MAGIC)
+        self._unindexed = 0  # records appended since the last index was written
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._read_index()
+
+    def _read_index(self) -> None:
+        with open(self.path, "rb") as file:
+            if file.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{self.path} is not a cassette file")
+            file.seek(-_FOOTER.size, os.SEEK_END)
+            footer_offset = file.tell()
+            index_offset, end = _FOOTER.unpack(file.read(_FOOTER.size))
+            if end != _END:
+                self._recover(file)
+                return
+            file.seek(index_offset)
+            length, = _LENGTH.unpack(file.read(_LENGTH.size))
+            self.index = json.loads(zlib.decompress(file.read(length)))
+        self._data_end = footer_offset + _FOOTER.size
+
+    def _recover(self, file) -> None:
+        """Rebuild the index of a cassette whose last records were never indexed."""
+        offset = len(_MAGIC)
+        file.seek(offset)
+        while True:
+            header = file.read(_LENGTH.size)
+            if len(header) < _LENGTH.size:
+                break
+            length, = _LENGTH.unpack(header)
+            try:
+                record = json.loads(zlib.decompress(file.read(length)))
+            except (zlib.error, ValueError):
+                break
+            if isinstance(record, dict) and "key" in record and "request" in record:
+                self.index.setdefault(record["key"], []).append(offset)
+                offset = file.tell()
+            else:
+                # An earlier index, followed by its footer
+                file.seek(_FOOTER.size, os.SEEK_CUR)
+                offset = file.tell()
+        self._data_end = offset  # anything past this is a partly written record
+        print(f"[cassette] {self.path} was not closed; recovered "
+              f"{sum(len(o) for o in self.index.values())} records")
+
+    def read(self, offset: int) -> dict:
+        with self._lock, open(self.path, "rb") as file:
+            file.seek(offset)
+            length, = _LENGTH.unpack(file.read(_LENGTH.size))
+            return json.loads(zlib.decompress(file.read(length)))
+
+    def append(self, record: dict) -> None:
+        payload = zlib.compress(json.dumps(record, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+                self._file.seek(0)
+                self._file.write(_MAGIC)
+                self._file.seek(self._data_end)
+                self._file.truncate()
+            offset = self._file.tell()
+            self._file.write(_LENGTH.pack(len(payload)) + payload)
+            self._file.flush()
+            self.index.setdefault(record["key"], []).append(offset)
+            self._unindexed += 1
+            if self._unindexed >= _INDEX_EVERY:
+                self._write_index()
+
+    def _write_index(self) -> None:
+        index_offset = self._file.tell()
+        payload = zlib.compress(json.dumps(self.index, separators=(",", ":")).encode("utf-8"))
+        self._file.write(_LENGTH.pack(len(payload)) + payload)
+        self._file.write(_FOOTER.pack(index_offset, _END))
+        self._file.flush()
+        self._unindexed = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is None:
+                return
+            if self._unindexed:
+                self._write_index()
+            self._data_end = self._file.tell()
+            self._file.close()
+            self._file = None
+
+
+class _RecordingCompletions:
+    def __init__(self, inner, cassette: Cassette):
+        self._inner = inner
+        self._cassette = cassette
+
+    def create(self, **kwargs):
+        key = request_key(kwargs)
+        started = time.perf_counter()
+        response = self._inner.create(**kwargs)
+        if kwargs.get("stream"):
+            return self._record_stream(key, kwargs, response, started)
+        self._cassette.append({
+            "key": key,
+            "request": to_plain(kwargs),
+            "response": to_plain(response),
+            "elapsed": time.perf_counter() - started,
+        })
+        return response
+
+    def _record_stream(self, key, kwargs, stream, started):
+        chunks = []
+        delays = []
+        last = started
+        for chunk in stream:
+            now = time.perf_counter()
+            delays.append(now - last)
+            last = now
+            chunks.append(to_plain(chunk))
+            yield chunk
+        self._cassette.append({
+            "key": key,
+            "request": to_plain(kwargs),
+            "chunks": chunks,
+            "delays": delays,
+            "elapsed": time.perf_counter() - started,
+        })
+
+
+class _ReplayCompletions:
+    def __init__(self, cassette: Cassette, latency: str, match: str = "tools"):
+        self._cassette = cassette
+        self._latency = latency
+        self._match = match
+        self._served = {}
+        self._order = sorted(offset for offsets in cassette.index.values() for offset in offsets)
+        self._by_shape = None  # tool-agnostic key -> offsets, built on the first hash miss
+        self._used = set()
+        self._start = None  # first record served in this session; earlier ones belong to other sessions
+        self._fallbacks = 0
+        self._lock = threading.Lock()
+
+    def create(self, **kwargs):
+        key = request_key(kwargs)
+        offsets = self._cassette.index.get(key)
+        with self._lock:
+            if offsets:
+                offset = self._serve(key, offsets)
+                record = None
+            else:
+                offset, record = self._on_miss(key, kwargs)
+            self._used.add(offset)
+            if self._start is None:
+                self._start = offset
+        if record is None:
+            record = self._cassette.read(offset)
+
+        if "chunks" in record:
+            return self._replay_stream(record)
+        if self._latency == "original":
+            time.sleep(record["elapsed"])
+        return to_attrs(record["response"])
+
+    def _serve(self, key: str, offsets: list) -> int:
+        n = self._served.get(key, 0)
+        self._served[key] = n + 1
+        # Repeated identical requests are served in recorded order, then the last one again
+        return offsets[min(n, len(offsets) - 1)]
+
+    def _on_miss(self, key: str, kwargs: dict):
+        """Serve a request whose exact hash was never recorded, or raise CassetteMiss."""
+        if self._by_shape is None:
+            self._by_shape = {}
+            for offset in self._order:
+                shape = tool_agnostic_key(self._cassette.read(offset)["request"])
+                self._by_shape.setdefault(shape, []).append(offset)
+        shape = tool_agnostic_key(kwargs)
+        offsets = self._by_shape.get(shape)
+        if offsets:
+            self._warn_fallback(key, "only in tool results")
+            return self._serve("tools:" + shape, offsets), None
+        if self._match == "order":
+            return self._next_in_order(key, kwargs)
+        raise CassetteMiss(f"No recorded response for request {key} in {self._cassette.path}")
+
+    def _warn_fallback(self, key: str, how: str) -> None:
+        self._fallbacks += 1
+        if self._fallbacks == 1:
+            print(f"[cassette] Request {key} differs from the recording {how}; "
+                  "serving such requests in recorded order")
+
+    def _next_in_order(self, key: str, kwargs: dict):
+        """The next unused record with the same model and stream flag, whatever the prompt."""
+        last_message = to_plain((kwargs.get("messages") or [None])[-1])
+        first = None
+        examined = 0
+        for offset in self._order:
+            if offset in self._used or (self._start is not None and offset < self._start):
+                continue
+            record = self._cassette.read(offset)
+            request = record["request"]
+            if request.get("model") != kwargs.get("model") or bool(request.get("stream")) != bool(kwargs.get("stream")):
+                continue
+            if (request.get("messages") or [None])[-1] == last_message:
+                first = (offset, record)
+                break
+            if first is None:
+                first = (offset, record)
+            examined += 1
+            if examined >= _FALLBACK_WINDOW:
+                break
+        if first is None:
+            raise CassetteMiss(f"No recorded response for request {key} in {self._cassette.path}")
+        self._warn_fallback(key, "(LMSTUDIO_CASSETTE_MATCH=order)")
+        return first
+
+    def _replay_stream(self, record):
+        for delay, chunk in zip(record["delays"], record["chunks"]):
+            if self._latency == "original":
+                time.sleep(delay)
+            yield to_attrs(chunk)
+
+
+class CassetteClient:
+    """Wraps an OpenAI client so chat.completions.create records to or replays from a cassette."""
+
+    def __init__(self, client, path: str, mode: str = "replay", latency: str = "zero", match: str = "tools"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if latency not in ("original", "zero"):
+            raise ValueError(f"Unknown cassette latency: {latency}")
+        if match not in ("tools", "order"):
+            raise ValueError(f"Unknown cassette match: {match}")
+        self._client = client
+        self.cassette = Cassette(path)
+        self.mode = mode
+        if mode == "record":
+            completions = _RecordingCompletions(client.chat.completions, self.cassette)
+            atexit.register(self.cassette.close)
+        else:
+            completions = _ReplayCompletions(self.cassette, latency, match)
+        self.chat = SimpleNamespace(completions=completions)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def close(self) -> None:
+        self.cassette.close()
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python cassette.py CASSETTE")
+        sys.exit(2)
+    cassette = Cassette(sys.argv[1])
+    total = 0.0
+    for key, offsets in cassette.index.items():
+        for offset in offsets:
+            record = cassette.read(offset)
+            request = record["request"]
+            total += record["elapsed"]
+            kind = f"stream ({len(record['chunks'])} chunks)" if "chunks" in record else "response"
+            print(f"{key}  {request.get('model', '?'):<40} {len(request.get('messages', [])):>3} msgs  "
+                  f"{kind:<20} {record['elapsed']:.2f}s")
+    print(f"\n{sum(len(o) for o in cassette.index.values())} records, {total:.1f}s of recorded generation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Type-ahead chat loop shared by the chat scripts.
+
+Input is read on its own thread and queued, so the next message can be
+typed while a reply is still generating. Generation runs on the main thread;
+pressing Ctrl-C while it runs raises KeyboardInterrupt inside the request,
+which closes the connection (and any stream), and the turn is dropped.
+Each turn works on a copy of the history and only commits it once the reply
+is complete, so a cancelled turn leaves no half-finished messages behind.
+Side effects that already happened, such as tool calls, are not undone.
+A turn whose reply is already out (e.g. before slower follow-up work) can
+call commit() so an interrupt after that point keeps what the user saw.
+
+When merge is on, messages that queued up during a generation are sent as
+one turn instead of one completion each. Ctrl-C while waiting for input, or
+end of input, ends the loop like the quit command.
+"""
+import queue
+import sys
+import threading
+from typing import Callable, Iterable, List, Optional
+
+
+class ChatLoop:
+    def __init__(
+        self,
+        prompt: Callable[[], str],
+        quit_words: Iterable[str] = ("quit",),
+        type_ahead: bool = True,
+        merge: bool = True,
+    ):
+        self.prompt = prompt
+        self.quit_words = {w.lower() for w in quit_words}
+        self.type_ahead = type_ahead
+        self.merge = merge
+        self.lines = queue.Queue()
+        self._held = []  # a line taken from the queue but left for the next turn
+        self._history = None
+        self._working = None
+        self._committed = False
+        if type_ahead:
+            threading.Thread(target=self._read_input, daemon=True).start()
+
+    def _read_input(self) -> None:
+        # Reads without a prompt; the loop prints the prompt when it is idle
+        while True:
+            line = sys.stdin.readline()
+            if not line:
+                self.lines.put(None)
+                return
+            self.lines.put(line.strip())
+
+    def _next_line(self, prompt: str) -> Optional[str]:
+        """The next line of input, or None at end of input."""
+        if not self.type_ahead:
+            try:
+                return input(prompt).strip()
+            except EOFError:
+                return None
+        try:
+            line = self._held.pop() if self._held else self.lines.get_nowait()
+            if line is not None:
+                print(f"{prompt}{line}  (typed ahead)")
+            return line
+        except queue.Empty:
+            print(prompt, end="", flush=True)
+            return self.lines.get()
+
+    def ask(self, prompt: str) -> str:
+        """Read one answer from the same input as the chat (e.g. a confirmation)."""
+        line = self._next_line(prompt)
+        return line or ""
+
+    def commit(self) -> None:
+        """Make the current turn's messages part of the history now, even if it is interrupted later."""
+        if self._history is not None:
+            self._history[:] = self._working
+            self._committed = True
+
+    def _take_turn(self) -> Optional[List[str]]:
+        """Lines for the next turn; None to quit. Queued lines are merged when enabled."""
+        line = self._next_line(self.prompt())
+        if line is None or line.lower() in self.quit_words:
+            return None
+        lines = [line]
+        while self.merge and self.type_ahead:
+            try:
+                queued = self.lines.get_nowait()
+            except queue.Empty:
+                break
+            if queued is None or queued.lower() in self.quit_words:
+                # Answer what came before the quit, then stop
+                self._held.append(queued)
+                break
+            print(f"{self.prompt()}{queued}  (typed ahead, merged)")
+            lines.append(queued)
+        return lines
+
+    def run(self, messages: List[dict], respond: Callable[[List[dict], str], None]) -> None:
+        """Call respond(messages, user_input) per turn until quit.
+
+        respond appends the user message and the reply to the list it is given,
+        which becomes the history only if the turn completes.
+        """
+        while True:
+            try:
+                lines = self._take_turn()
+            except KeyboardInterrupt:
+                print()
+                return
+            if lines is None:
+                return
+
+            working = list(messages)
+            self._history, self._working, self._committed = messages, working, False
+            try:
+                respond(working, "\n".join(line for line in lines if line))
+            except KeyboardInterrupt:
+                if self._committed:
+                    print("\n[cancelled] Interrupted; the reply shown so far was kept")
+                else:
+                    print("\n[cancelled] Reply interrupted; the message was dropped from the history")
+                continue
+            finally:
+                self._history = self._working = None
+            messages[:] = working
@@ -0,0 +1,61 @@
+"""Shared construction of the LM Studio client used by the chat scripts.
+
+Environment variables:
+    LMSTUDIO_BASE_URL           server URL (default http://localhost:1234/v1)
+    LMSTUDIO_BACKENDS           backend pool config (default backends.yaml if it exists);
+                                overrides LMSTUDIO_BASE_URL, see backends.py
+    LMSTUDIO_CASSETTE           cassette file to record to or replay from
+    LMSTUDIO_CASSETTE_MODE      "record" or "replay" (default "replay")
+    LMSTUDIO_CASSETTE_LATENCY   "original" or "zero" replay latency (default "zero")
+    LMSTUDIO_CASSETTE_MATCH     "tools" (default) replays requests that differ from the
+                                recording only in tool results; "order" serves any miss
+                                the next unused record of the same model, see cassette.py
+
+Pass draft_models to make_client() to use speculative decoding for those
+models; see speculative.py.
+
+Requests are also queued through scheduler.default_scheduler; see scheduler.py
+for its settings. Pass priority=scheduler.FOLLOW_UP (or BATCH) to create() for
+anything that is not a fresh user turn.
+"""
+import os
+import random
+import sys
+from openai import OpenAI
+from backends import PoolClient, load_pool
+from cassette import CassetteClient, cassette_active
+from scheduler import ScheduledClient, default_scheduler
+from speculative import SpeculativeClient
+
+BASE_URL = os.environ.get("LMSTUDIO_BASE_URL", "http://localhost:1234/v1")
+API_KEY = "lm-studio"
+CASSETTE_SEED = 0
+
+pool = load_pool()
+
+
+def make_client(base_url: str = BASE_URL, api_key: str = API_KEY, session: str = None, draft_models: dict = None):
+    """Create the OpenAI-compatible client, scheduled and wrapped in a cassette when one is configured."""
+    session = session or f"{os.path.basename(sys.argv[0]) or 'python'}-{os.getpid()}"
+    if pool is not None:
+        client = PoolClient(pool, session)
+    else:
+        client = OpenAI(base_url=base_url, api_key=api_key)
+
+    # Below the cassette, so a draft model's fallback never changes the recorded requests
+    if draft_models:
+        client = SpeculativeClient(client, draft_models)
+        client.report_at_exit()
+
+    if cassette_active():
+        # Dice rolls and random choices end up in prompts, so make them repeat between record and replay
+        random.seed(CASSETTE_SEED)
+        client = CassetteClient(
+            client,
+            os.environ["LMSTUDIO_CASSETTE"],
+            mode=os.environ.get("LMSTUDIO_CASSETTE_MODE", "replay"),
+            latency=os.environ.get("LMSTUDIO_CASSETTE_LATENCY", "zero"),
+            match=os.environ.get("LMSTUDIO_CASSETTE_MATCH", "tools"),
+        )
+
+    return ScheduledClient(client, default_scheduler, session)
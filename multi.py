@@ -5,19 +5,56 @@ from datetime import datetime
 import os
 import re
 import copy
-from openai import OpenAI
-
-# Point to the local server
-client = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
+import time
+from lmclient import make_client
+from cassette import cassette_active
+from scheduler import FOLLOW_UP
+import urlpolicy
+from router import ModelRouter
+from budget import BudgetController, TOOL_FOLLOW_UP
+from reasoning import ReasoningStats, no_think, strip_reasoning
+from chatloop import ChatLoop
 
 # Primary and fallback models
 DEFAULT_MODEL = "qwen3-8b"
 FALLBACK_MODEL = "unfilteredai_dan-qwen3-1.7b"
 
+# Speculative decoding: model -> smaller draft model of the same family (see speculative.py).
+# Off by default; e.g. {DEFAULT_MODEL: FALLBACK_MODEL} to turn it on (both must be loaded on the server).
+DRAFT_MODELS = {}
+
+# Point to the local server
+client = make_client(draft_models=DRAFT_MODELS)
+
+# Models tried in order when a reply is refused or empty. Add more to extend the cascade.
+MODEL_CASCADE = [DEFAULT_MODEL, FALLBACK_MODEL]
+
 # Switching configuration
 REQUIRE_CONFIRM_BEFORE_SWITCH = False   # If True, ask user before switching
 MAX_SWITCHES_PER_TURN = 1               # Max tries to switch per user turn
 
+# Adaptive routing: reorder the cascade per prompt from learned refusal/latency statistics
+ADAPTIVE_ROUTING = True
+ROUTER_STATE_PATH = "router_state.json"  # None to keep statistics in memory only
+
+router = ModelRouter(MODEL_CASCADE, ROUTER_STATE_PATH, frozen=cassette_active())
+
+# Learned max_tokens/stop budgets per turn type (see budget.py)
+BUDGET_STATE_PATH = "budget_state.json"
+generation_budget = BudgetController(BUDGET_STATE_PATH, frozen=cassette_active())
+generation_budget.report_at_exit()
+
+# qwen3 reasoning: <think> blocks are stripped from replies, and the follow-up
+# after tool results is a fast turn with reasoning switched off
+FAST_TOOL_FOLLOW_UPS = True
+reasoning_stats = ReasoningStats()
+reasoning_stats.report_at_exit()
+
+# Read input on its own thread so messages can be typed while a reply generates (see chatloop.py);
+# messages typed during one reply are merged into a single request. Ctrl-C cancels a reply.
+TYPE_AHEAD = True
+MERGE_QUEUED_MESSAGES = True
+
 # Default trigger patterns (regex). Edit or replace with your own triggers.
 SWITCH_TRIGGERS = [
     r"\bI (?:can't|cannot|won't|am unable to|refuse to) (?:help|assist|comply)\b",
@@ -36,6 +73,28 @@ SWITCH_TRIGGERS = [
 
 COMPILED_TRIGGERS = [re.compile(p, re.I) for p in SWITCH_TRIGGERS]
 
+# Allowed domains for open_safe_url (subdomains included) and optional list files
+SAFE_DOMAINS = {
+    "lmstudio.ai",
+    "github.com",
+    "google.com",
+    "wikipedia.org",
+    "weather.com",
+    "stackoverflow.com",
+    "python.org",
+    "docs.python.org",
+}
+ALLOWLIST_FILES = []
+BLOCKLIST_FILES = []
+URL_POLICY_CACHE = None  # e.g. "url_policy.cache" to memory-map large lists
+
+url_policy = urlpolicy.PolicyEngine(
+    allow=SAFE_DOMAINS,
+    allow_files=ALLOWLIST_FILES,
+    block_files=BLOCKLIST_FILES,
+    cache_path=URL_POLICY_CACHE,
+)
+
 
 def should_switch_model(text: str) -> bool:
     """Return True if any trigger regex matches the text."""
@@ -56,17 +115,6 @@ def is_valid_url(url: str) -> bool:
 
 
 def open_safe_url(url: str) -> dict:
-    SAFE_DOMAINS = {
-        "lmstudio.ai",
-        "github.com",
-        "google.com",
-        "wikipedia.org",
-        "weather.com",
-        "stackoverflow.com",
-        "python.org",
-        "docs.python.org",
-    }
-
     try:
         if not url.startswith(("http://", "https://")):
             url = "http://" + url
@@ -74,13 +122,17 @@ def open_safe_url(url: str) -> dict:
         if not is_valid_url(url):
             return {"status": "error", "message": f"Invalid URL format: {url}"}
 
-        parsed_url = urlparse(url)
-        domain = parsed_url.netloc.lower()
-        base_domain = ".".join(domain.split(".")[-2:])
+        checked = urlpolicy.checked_url(url)
+        if checked is None:
+            return {"status": "error", "message": f"Invalid URL format: {url}"}
+        domain, url = checked
+        decision = url_policy.decide(domain)
 
-        if base_domain in SAFE_DOMAINS:
+        if decision == urlpolicy.ALLOW:
             webbrowser.open(url)
             return {"status": "success", "message": f"Opened {url} in browser"}
+        elif decision == urlpolicy.BLOCK:
+            return {"status": "error", "message": f"Domain {domain} is blocked"}
         else:
             return {"status": "error", "message": f"Domain {domain} not in allowed list"}
     except Exception as e:
@@ -222,17 +274,19 @@ def process_tool_calls(response, messages, model_name):
         messages.append(tool_result_message)
 
     # Ask the model to produce a final assistant message after tool outputs
-    final_response = client.chat.completions.create(
+    reasoning_stats.request_sent()
+    final_response = generation_budget.create(
+        client,
+        TOOL_FOLLOW_UP,
         model=model_name,
-        messages=messages,
+        messages=no_think(messages) if FAST_TOOL_FOLLOW_UPS else messages,
+        priority=FOLLOW_UP,
     )
 
     return final_response
 
 
 def chat():
-    current_model = DEFAULT_MODEL
-
     messages = [
         {
             "role": "system",
@@ -243,18 +297,23 @@ def chat():
     print("Assistant: Hello! I can help you open safe web links, tell you the current time, and analyse directory contents. What would you like me to do?")
     print("(Type 'quit' to exit)")
 
-    while True:
-        user_input = input("\nYou: ").strip()
-        if user_input.lower() == "quit":
-            print("Assistant: Goodbye!")
-            break
+    loop = ChatLoop(lambda: "\nYou: ", type_ahead=TYPE_AHEAD, merge=MERGE_QUEUED_MESSAGES)
 
+    def respond(messages, user_input):
         # Add user message and take a snapshot of messages to allow rollback if we switch models
         messages.append({"role": "user", "content": user_input})
         messages_snapshot = copy.deepcopy(messages)
 
+        # Order the cascade for this prompt; the first entry is the model most likely to answer well and quickly
+        cascade = router.rank(user_input) if ADAPTIVE_ROUTING else list(MODEL_CASCADE)
+        position = 0
+        current_model = cascade[0]
+
         attempts = 0
         while True:
+            started = time.perf_counter()
+            generating = client.scheduler.slot_seconds()
+            reasoning_stats.request_sent()
             try:
                 response = client.chat.completions.create(
                     model=current_model,
@@ -266,13 +325,14 @@ def chat():
                 break
 
             # If model instructs tool calls, run them and get the final assistant response
-            has_tool_calls = False
             try:
                 has_tool_call = bool(response.choices[0].message.tool_calls)
             except Exception:
                 has_tool_call = False
 
             if has_tool_call:
+                # Only the follow-up's tokens are counted, so time only its generation
+                generating = client.scheduler.slot_seconds()
                 final_response = process_tool_calls(response, messages, current_model)
             else:
                 final_response = response
@@ -283,36 +343,63 @@ def chat():
             except Exception:
                 assistant_text = ""
 
-            # Decide whether to switch to fallback model
-            if should_switch_model(assistant_text) and current_model != FALLBACK_MODEL and attempts < MAX_SWITCHES_PER_TURN:
+            # Keep reasoning out of the refusal check, the printed answer and the stored history
+            elapsed = time.perf_counter() - started
+            assistant_text, reasoning_text = strip_reasoning(assistant_text)
+            usage = getattr(final_response, "usage", None)
+            reasoning_stats.record(
+                reasoning_text,
+                getattr(usage, "completion_tokens", None),
+                client.scheduler.slot_seconds() - generating,
+                fast=has_tool_call and FAST_TOOL_FOLLOW_UPS,
+            )
+
+            refused = should_switch_model(assistant_text)
+            router.record(current_model, user_input, elapsed, refused, not assistant_text)
+            router.save()
+            next_model = cascade[position + 1] if position + 1 < len(cascade) else None
+
+            # Decide whether to switch to the next model in the cascade
+            if refused and next_model and attempts < MAX_SWITCHES_PER_TURN:
                 # optionally ask user
                 if REQUIRE_CONFIRM_BEFORE_SWITCH:
-                    confirm = input(f"\nThe assistant response looks like a refusal. Switch to fallback model '{FALLBACK_MODEL}' and retry? (y/N): ").strip().lower()
+                    confirm = loop.ask(f"\nThe assistant response looks like a refusal. Switch to fallback model '{next_model}' and retry? (y/N): ").strip().lower()
                     if confirm not in ("y", "yes"):
                         print("\nAssistant:", assistant_text)
                         messages.append({"role": "assistant", "content": assistant_text})
+                        reasoning_stats.kept_out(reasoning_text)
                         break
 
-                print(f"\nSwitching model from '{current_model}' to '{FALLBACK_MODEL}' and retrying the same user request...")
-                current_model = FALLBACK_MODEL
+                print(f"\nSwitching model from '{current_model}' to '{next_model}' and retrying the same user request...")
+                current_model = next_model
+                position += 1
                 attempts += 1
                 # Roll back messages to before the assistant/tool outputs so they won't be doubled
-                messages = copy.deepcopy(messages_snapshot)
-                continue  # re-send the same user message with the fallback model
+                messages[:] = copy.deepcopy(messages_snapshot)
+                continue  # re-send the same user message with the next model
 
-            # Check if the fallback model returned an empty message
+            # Check if the model returned an empty message
             if not assistant_text:
-                print("\nFallback model returned an empty message. Switching back to default model...")
-                current_model = DEFAULT_MODEL
                 # Rollback messages to before the assistant/tool outputs so they won't be doubled
-                messages = copy.deepcopy(messages_snapshot)
-                continue  # Re-send the same user message with the default model
+                messages[:] = copy.deepcopy(messages_snapshot)
+                if next_model is None:
+                    print("\nEvery model returned an empty message. Please try again.")
+                    messages.pop()
+                    break
+                print(f"\n'{current_model}' returned an empty message. Trying '{next_model}'...")
+                current_model = next_model
+                position += 1
+                continue  # Re-send the same user message with the next model
 
             # Otherwise accept and store the assistant response
             print("\nAssistant:", assistant_text)
             messages.append({"role": "assistant", "content": assistant_text})
+            reasoning_stats.kept_out(reasoning_text)
             break
 
+    loop.run(messages, respond)
+    print("Assistant: Goodbye!")
+
 
 if __name__ == "__main__":
     chat()
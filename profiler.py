@@ -0,0 +1,262 @@
+"""Throughput profiler for models served by a local OpenAI-compatible endpoint.
+
+Sweeps prompt length, output length, tool-schema size and concurrency for
+each model and records, per configuration, prompt-processing tokens/sec,
+generation tokens/sec, time-to-first-token and latency percentiles. Every
+request is streamed so the first token can be timed. Each request's prompt
+starts with a fresh nonce so the server's prompt cache does not hide
+prompt-processing cost (pass --allow-cache to measure warm prefixes).
+
+    python profiler.py --models qwen3-8b unfilteredai_dan-qwen3-1.7b
+    python profiler.py --prompt-tokens 512 4096 --concurrency 1 4 --out-dir profiles
+    python profiler.py --compare profiles/qwen3-8b-*.json profiles/unfilteredai*.json
+
+Reports are written as JSON (plus a CSV with the same rows) so runs on
+different days or machines can be compared.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import re
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from openai import OpenAI
+
+from budget import percentile
+
+DEFAULT_BASE_URL = os.environ.get("LMSTUDIO_BASE_URL", "http://localhost:1234/v1")
+DEFAULT_MODELS = ["qwen3-8b", "unfilteredai_dan-qwen3-1.7b", "huihui-ai_huihui-gpt-oss-20b-abliterated"]
+CHARS_PER_TOKEN = 4  # filler text is sized with this estimate; reports use server token counts
+
+FILLER = (
+    "The Jeff drifts through the night market, past lantern-lit stalls selling grilled corn, "
+    "knock-off watches and cracked phone screens, while a brass band rehearses behind the fountain. "
+)
+
+
+def make_prompt(prompt_tokens: int, allow_cache: bool) -> str:
+    nonce = "" if allow_cache else f"[{uuid.uuid4().hex}] "
+    body = (FILLER * (prompt_tokens * CHARS_PER_TOKEN // len(FILLER) + 1))[: prompt_tokens * CHARS_PER_TOKEN]
+    return nonce + body + "\n\nContinue this scene in vivid detail."
+
+
+def make_tools(count: int) -> list:
+    """Synthetic tool schemas about the size of the ones in agent.py and thejeff.py."""
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": f"tool_{i}",
+                "description": f"Synthetic tool number {i} used to measure the cost of tool schemas in the prompt",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "target": {"type": "string", "description": "What the tool acts on"},
+                        "amount": {"type": "integer", "description": "How much to apply (default 1)", "default": 1},
+                        "mode": {"type": "string", "enum": ["fast", "careful"], "description": "Execution mode"},
+                    },
+                    "required": ["target"],
+                },
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def _percentile(values, q: float):
+    return percentile(values, q) if values else None
+
+
+def timed_request(client, model: str, prompt: str, max_tokens: int, tools: list) -> dict:
+    """Send one streamed request and time its first token and completion."""
+    kwargs = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": max_tokens,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+    if tools:
+        kwargs["tools"] = tools
+        kwargs["tool_choice"] = "none"
+
+    started = time.perf_counter()
+    first = None
+    chunks = 0
+    usage = None
+    for chunk in client.chat.completions.create(**kwargs):
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        # Reasoning models may stream into reasoning_content before any content
+        if delta.content or getattr(delta, "reasoning_content", None) or delta.tool_calls:
+            chunks += 1
+            if first is None:
+                first = time.perf_counter()
+    ended = time.perf_counter()
+
+    prompt_tokens = usage.prompt_tokens if usage else len(prompt) // CHARS_PER_TOKEN
+    completion_tokens = usage.completion_tokens if usage else chunks
+    ttft = (first or ended) - started
+    generation_time = ended - (first or ended)
+    return {
+        "ttft_s": ttft,
+        "latency_s": ended - started,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "prompt_tps": prompt_tokens / ttft if ttft > 0 else None,
+        "gen_tps": (completion_tokens - 1) / generation_time if generation_time > 0 and completion_tokens > 1 else None,
+    }
+
+
+def profile_config(client, model, prompt_tokens, output_tokens, tool_count, concurrency, repeats, allow_cache) -> dict:
+    tools = make_tools(tool_count)
+    samples = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        try:
+            result = timed_request(client, model, make_prompt(prompt_tokens, allow_cache), output_tokens, tools)
+            with lock:
+                samples.append(result)
+        except Exception as e:
+            with lock:
+                errors += 1
+            print(f"    request failed: {e}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(repeats):
+            list(executor.map(one, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    def values(key):
+        return [s[key] for s in samples if s[key] is not None]
+
+    def mean(key):
+        v = values(key)
+        return statistics.mean(v) if v else None
+
+    return {
+        "model": model,
+        "prompt_tokens": prompt_tokens,
+        "output_tokens": output_tokens,
+        "tools": tool_count,
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": errors,
+        "measured_prompt_tokens": mean("prompt_tokens"),
+        "measured_completion_tokens": mean("completion_tokens"),
+        "prompt_tps": mean("prompt_tps"),
+        "gen_tps": mean("gen_tps"),
+        "aggregate_gen_tps": sum(values("completion_tokens")) / wall if wall > 0 else None,
+        "ttft_p50_s": _percentile(values("ttft_s"), 0.50),
+        "ttft_p95_s": _percentile(values("ttft_s"), 0.95),
+        "latency_p50_s": _percentile(values("latency_s"), 0.50),
+        "latency_p95_s": _percentile(values("latency_s"), 0.95),
+        "latency_p99_s": _percentile(values("latency_s"), 0.99),
+    }
+
+
+def _fmt(value, digits=1):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_header() -> None:
+    print(f"{'model':<42} {'prompt':>6} {'out':>5} {'tools':>5} {'conc':>4} | {'pp tok/s':>9} {'gen tok/s':>9} "
+          f"{'agg tok/s':>9} | {'ttft p50':>8} {'ttft p95':>8} | {'lat p50':>7} {'p95':>7} {'p99':>7}")
+
+
+def print_row(r: dict) -> None:
+    print(f"{r['model'][:42]:<42} {r['prompt_tokens']:>6} {r['output_tokens']:>5} {r['tools']:>5} {r['concurrency']:>4} | "
+          f"{_fmt(r['prompt_tps']):>9} {_fmt(r['gen_tps']):>9} {_fmt(r['aggregate_gen_tps']):>9} | "
+          f"{_fmt(r['ttft_p50_s'], 2):>8} {_fmt(r['ttft_p95_s'], 2):>8} | "
+          f"{_fmt(r['latency_p50_s'], 2):>7} {_fmt(r['latency_p95_s'], 2):>7} {_fmt(r['latency_p99_s'], 2):>7}")
+
+
+def write_report(out_dir: str, model: str, base_url: str, rows: list) -> str:
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model)
+    path = os.path.join(out_dir, f"{slug}-{stamp}.json")
+    with open(path, "w") as file:
+        json.dump({
+            "model": model,
+            "base_url": base_url,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "host": platform.node(),
+            "rows": rows,
+        }, file, indent=2)
+    with open(path[:-len(".json")] + ".csv", "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def compare(paths) -> None:
+    """Print the rows of several reports side by side, grouped by configuration."""
+    rows = []
+    for path in paths:
+        with open(path, "r") as file:
+            report = json.load(file)
+        for row in report["rows"]:
+            rows.append(dict(row, model=f"{row['model']} ({report['timestamp']})"))
+    rows.sort(key=lambda r: (r["prompt_tokens"], r["output_tokens"], r["tools"], r["concurrency"], -(r["gen_tps"] or 0)))
+    print_header()
+    for row in rows:
+        print_row(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile model throughput on a local endpoint")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    parser.add_argument("--models", nargs="+", default=DEFAULT_MODELS)
+    parser.add_argument("--prompt-tokens", nargs="+", type=int, default=[256, 1024, 4096])
+    parser.add_argument("--output-tokens", nargs="+", type=int, default=[64, 256])
+    parser.add_argument("--tools", nargs="+", type=int, default=[0, 4, 16], help="Tool schema counts")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--repeats", type=int, default=3, help="Batches of concurrent requests per configuration")
+    parser.add_argument("--allow-cache", action="store_true", help="Reuse identical prompts (measures warm prefixes)")
+    parser.add_argument("--out-dir", default="profiles")
+    parser.add_argument("--compare", nargs="+", metavar="REPORT", help="Compare saved reports instead of profiling")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+
+    client = OpenAI(base_url=args.base_url, api_key="lm-studio")
+    for model in args.models:
+        print(f"\n=== {model} ===")
+        print_header()
+        rows = []
+        for prompt_tokens in args.prompt_tokens:
+            for output_tokens in args.output_tokens:
+                for tool_count in args.tools:
+                    for concurrency in args.concurrency:
+                        row = profile_config(
+                            client, model, prompt_tokens, output_tokens, tool_count,
+                            concurrency, args.repeats, args.allow_cache,
+                        )
+                        rows.append(row)
+                        print_row(row)
+        if any(r["requests"] for r in rows):
+            print(f"Report written to {write_report(args.out_dir, model, args.base_url, rows)}")
+        else:
+            print(f"No successful requests for {model}; no report written")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Handling of qwen3-style <think>...</think> reasoning.
+
+Reasoning is removed from replies before they are printed, stored in the
+message history or checked for refusals, and ReasoningStream does the same
+for streamed output as chunks arrive. no_think() marks a request as a "fast"
+turn with qwen3's /no_think soft switch so the model skips reasoning, which
+is worth it for cheap turns such as the follow-up after tool results.
+
+ReasoningStats estimates what this saves per session: reasoning tokens no
+longer re-sent in the history on later turns, and reasoning tokens (and
+seconds, at the measured generation speed) skipped on fast turns. Only
+replies that are appended to the history count towards the first figure;
+side requests such as private views or rolled-back attempts never would
+have been resent.
+
+    LMSTUDIO_REASONING_REPORT   print the per-session report at exit when set
+"""
+import atexit
+import os
+import re
+import threading
+from typing import List, Tuple
+
+OPEN_TAG = "<think>"
+CLOSE_TAG = "</think>"
+NO_THINK = "/no_think"
+CHARS_PER_TOKEN = 4  # rough estimate when no tokenizer is available
+
+_BLOCK = re.compile(r"<think>.*?</think>", re.S)
+
+
+def strip_reasoning(text: str) -> Tuple[str, str]:
+    """Split text into (answer, reasoning), removing every reasoning block."""
+    if not text or ("<think" not in text and CLOSE_TAG not in text):
+        return text or "", ""
+    reasoning = []
+
+    # Some chat templates open the block in the prompt, so only the closing tag is generated
+    if CLOSE_TAG in text and (OPEN_TAG not in text or text.index(CLOSE_TAG) < text.index(OPEN_TAG)):
+        head, text = text.split(CLOSE_TAG, 1)
+        reasoning.append(head)
+
+    def remove(match):
+        reasoning.append(match.group(0)[len(OPEN_TAG):-len(CLOSE_TAG)])
+        return ""
+
+    text = _BLOCK.sub(remove, text)
+
+    # An unterminated block (generation cut off mid-thought) is reasoning to the end
+    if OPEN_TAG in text:
+        text, tail = text.split(OPEN_TAG, 1)
+        reasoning.append(tail)
+
+    return text.strip(), "\n".join(r.strip() for r in reasoning if r.strip())
+
+
+def no_think(messages: List[dict]) -> List[dict]:
+    """Copy of messages with /no_think added to the last user message.
+
+    The switch goes on the latest user turn rather than the system prompt so
+    the cached prompt prefix on the server stays valid.
+    """
+    messages = list(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        message = messages[i]
+        if isinstance(message, dict) and message.get("role") == "user":
+            content = message.get("content") or ""
+            if NO_THINK not in content:
+                messages[i] = dict(message, content=f"{content} {NO_THINK}".strip())
+            break
+    return messages
+
+
+class ReasoningStream:
+    """Incrementally removes reasoning from streamed text.
+
+    feed() returns the visible part of each chunk; text that might be the
+    start of a tag is held back until the next chunk decides it.
+    """
+
+    def __init__(self, starts_in_reasoning: bool = False):
+        self.in_reasoning = starts_in_reasoning
+        self.reasoning = []
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        text = self._pending + (chunk or "")
+        self._pending = ""
+        visible = []
+        while text:
+            tag = CLOSE_TAG if self.in_reasoning else OPEN_TAG
+            index = text.find(tag)
+            if index < 0:
+                # Hold back a suffix that could be the beginning of the tag
+                keep = 0
+                for n in range(min(len(tag) - 1, len(text)), 0, -1):
+                    if tag.startswith(text[-n:]):
+                        keep = n
+                        break
+                body, self._pending = text[:len(text) - keep], text[len(text) - keep:]
+                (self.reasoning if self.in_reasoning else visible).append(body)
+                break
+            (self.reasoning if self.in_reasoning else visible).append(text[:index])
+            text = text[index + len(tag):]
+            self.in_reasoning = not self.in_reasoning
+        return "".join(visible)
+
+    def close(self) -> str:
+        """Flush held-back text at the end of the stream."""
+        text, self._pending = self._pending, ""
+        if self.in_reasoning:
+            self.reasoning.append(text)
+            return ""
+        return text
+
+    @property
+    def reasoning_text(self) -> str:
+        return "".join(self.reasoning).strip()
+
+
+class ReasoningStats:
+    """Per-session estimate of reasoning tokens and time saved."""
+
+    def __init__(self):
+        self.replies = 0
+        self.fast_replies = 0
+        self.reasoning_tokens = 0  # generated on normal turns
+        self.fast_reasoning_tokens = 0
+        self.stripped_tokens = 0  # reasoning kept out of the history so far
+        self.history_tokens_saved = 0
+        self.fast_tokens_saved = 0.0
+        self.fast_seconds_saved = 0.0
+        self._lock = threading.Lock()  # private views record from several threads at once
+
+    def record(self, reasoning: str, completion_tokens: int = None, elapsed: float = None, fast: bool = False) -> None:
+        """Record one generated reply's reasoning; completion_tokens/elapsed give the generation speed."""
+        tokens = len(reasoning) // CHARS_PER_TOKEN
+        with self._lock:
+            if not fast:
+                self.replies += 1
+                self.reasoning_tokens += tokens
+                return
+
+            self.fast_replies += 1
+            self.fast_reasoning_tokens += tokens
+            if self.replies:
+                saved = max(0.0, self.reasoning_tokens / self.replies - tokens)
+                self.fast_tokens_saved += saved
+                if completion_tokens and elapsed:
+                    self.fast_seconds_saved += saved / (completion_tokens / elapsed)
+
+    def kept_out(self, reasoning: str) -> None:
+        """Count reasoning stripped from a reply that was appended to the history."""
+        with self._lock:
+            self.stripped_tokens += len(reasoning) // CHARS_PER_TOKEN
+
+    def request_sent(self) -> None:
+        """Count the stripped reasoning that this request did not have to resend."""
+        with self._lock:
+            self.history_tokens_saved += self.stripped_tokens
+
+    def report(self) -> str:
+        with self._lock:
+            return (
+                f"[reasoning] {self.replies} normal / {self.fast_replies} fast replies; "
+                f"~{self.stripped_tokens} reasoning tokens kept out of history "
+                f"(~{self.history_tokens_saved} prompt tokens not resent); "
+                f"fast turns skipped ~{self.fast_tokens_saved:.0f} tokens / {self.fast_seconds_saved:.1f}s"
+            )
+
+    def report_at_exit(self) -> None:
+        if os.environ.get("LMSTUDIO_REASONING_REPORT"):
+            atexit.register(lambda: print(self.report()))
@@ -0,0 +1,206 @@
+"""Adaptive model routing for a cascade of local models.
+
+For every model the router keeps running latency, refusal and empty-response
+statistics, split by a coarse prompt-length bucket, plus a small online
+logistic classifier over hashed word n-grams that predicts whether that
+model will refuse a given prompt. The classifier learns from each switch
+decision the chat loop makes.
+
+Each turn the configured cascade is walked from the back: a model is tried
+only if its expected cost (its latency, plus the rest of the cascade when it
+fails) beats skipping straight to the models after it. Answers from models
+further down the cascade are charged QUALITY_PENALTY_S seconds per position,
+so a fast fallback does not displace the preferred model unless the
+preferred one is likely to refuse or come back empty. A skipped model would
+never see those prompts again, so with probability EXPLORATION_RATE a
+ranking that skips models is replaced by the configured order, letting the
+router unlearn an early run of refusals.
+
+State is saved as JSON so what the router learns survives between runs; a
+save only replaces the models this process has learned about, so scripts
+sharing the file keep each other's statistics (see statefile.py). A
+frozen router (used while a cassette records or replays) always returns the
+configured order and neither learns nor saves.
+"""
+import json
+import math
+import os
+import random
+import re
+import zlib
+from typing import Dict, List, Optional
+
+from statefile import update_json
+
+N_FEATURES = 1 << 12
+LEARNING_RATE = 0.3
+L2 = 1e-4
+PRIOR_REFUSAL_BIAS = -3.0  # sigmoid(-3) ~ 5% refusal before anything is learned
+LATENCY_DECAY = 0.2  # weight of the newest sample in the latency average
+QUALITY_PENALTY_S = 10.0  # seconds an answer is considered worse per step down the cascade
+EXPLORATION_RATE = 0.1  # share of skipping rankings that try the configured order instead
+
+_WORD = re.compile(r"\w+")
+
+
+def prompt_features(prompt: str) -> List[int]:
+    """Hash the prompt's lower-cased word unigrams and bigrams into feature indices."""
+    words = _WORD.findall(prompt.lower())
+    grams = words + [a + " " + b for a, b in zip(words, words[1:])]
+    return sorted({zlib.crc32(g.encode("utf-8")) % N_FEATURES for g in grams})
+
+
+def length_bucket(prompt: str) -> str:
+    n = len(prompt)
+    return "short" if n < 80 else "medium" if n < 600 else "long"
+
+
+def _sigmoid(x: float) -> float:
+    if x < -30:
+        return 0.0
+    if x > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+class ModelRouter:
+    """Orders a model cascade per prompt and learns from every attempt."""
+
+    def __init__(self, models: List[str], path: Optional[str] = None, frozen: bool = False, seed: Optional[int] = None):
+        self.models = list(models)
+        self._random = random.Random(seed)
+        self.path = None if frozen else path
+        self.frozen = frozen
+        self.stats: Dict[str, Dict[str, dict]] = {}
+        self.weights: Dict[str, Dict[str, float]] = {}
+        self.bias: Dict[str, float] = {}
+        self._dirty = set()  # models this process has recorded attempts for
+        if self.path and os.path.exists(self.path):
+            self.load()
+
+    def _bucket_stats(self, model: str, bucket: str) -> dict:
+        buckets = self.stats.setdefault(model, {})
+        if bucket not in buckets:
+            buckets[bucket] = {"attempts": 0, "refusals": 0, "empties": 0, "latency": None}
+        return buckets[bucket]
+
+    def refusal_probability(self, model: str, features: List[int]) -> float:
+        weights = self.weights.get(model, {})
+        score = self.bias.get(model, PRIOR_REFUSAL_BIAS)
+        for f in features:
+            score += weights.get(str(f), 0.0)
+        return _sigmoid(score)
+
+    def empty_probability(self, model: str, bucket: str) -> float:
+        s = self._bucket_stats(model, bucket)
+        return (s["empties"] + 0.5) / (s["attempts"] + 10)  # smoothed towards ~5%
+
+    def expected_latency(self, model: str, bucket: str) -> Optional[float]:
+        latency = self._bucket_stats(model, bucket)["latency"]
+        if latency is None:
+            known = [b["latency"] for b in self.stats.get(model, {}).values() if b["latency"] is not None]
+            latency = sum(known) / len(known) if known else None
+        return latency
+
+    def rank(self, prompt: str) -> List[str]:
+        """Return the cascade for this prompt: models worth trying first, skipped models last."""
+        if self.frozen:
+            return list(self.models)
+        features = prompt_features(prompt)
+        bucket = length_bucket(prompt)
+
+        latencies = {m: self.expected_latency(m, bucket) for m in self.models}
+        known = [l for l in latencies.values() if l is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+
+        # Expected cost of the remaining cascade, computed from the last model backwards
+        last = len(self.models) - 1
+        tried = [True] * len(self.models)
+        rest = None
+        for position in range(last, -1, -1):
+            model = self.models[position]
+            latency = latencies[model] if latencies[model] is not None else default_latency
+            answer_cost = latency + QUALITY_PENALTY_S * position
+            if rest is None:
+                rest = answer_cost
+                continue
+            fail = 1 - (1 - self.refusal_probability(model, features)) * (1 - self.empty_probability(model, bucket))
+            try_cost = (1 - fail) * answer_cost + fail * (latency + rest)
+            if try_cost <= rest:
+                rest = try_cost
+            else:
+                tried[position] = False
+
+        if not all(tried) and self._random.random() < EXPLORATION_RATE:
+            return list(self.models)  # explore: give skipped models a chance to prove the statistics wrong
+        return [m for m, t in zip(self.models, tried) if t] + [m for m, t in zip(self.models, tried) if not t]
+
+    def record(self, model: str, prompt: str, latency: float, refused: bool, empty: bool) -> None:
+        """Update running statistics and the refusal classifier with one attempt."""
+        if self.frozen:
+            return
+        self._dirty.add(model)
+        s = self._bucket_stats(model, length_bucket(prompt))
+        s["attempts"] += 1
+        s["refusals"] += int(refused)
+        s["empties"] += int(empty)
+        if s["latency"] is None:
+            s["latency"] = latency
+        else:
+            s["latency"] += LATENCY_DECAY * (latency - s["latency"])
+
+        if empty:
+            return  # an empty reply says nothing about whether the prompt is refused
+
+        features = prompt_features(prompt)
+        error = float(refused) - self.refusal_probability(model, features)
+        weights = self.weights.setdefault(model, {})
+        for f in features:
+            key = str(f)
+            w = weights.get(key, 0.0)
+            weights[key] = w + LEARNING_RATE * (error - L2 * w)
+        self.bias[model] = self.bias.get(model, PRIOR_REFUSAL_BIAS) + LEARNING_RATE * error
+
+    def summary(self) -> Dict[str, dict]:
+        """Per-model totals across buckets, for printing."""
+        out = {}
+        for model in self.models:
+            buckets = self.stats.get(model, {}).values()
+            attempts = sum(b["attempts"] for b in buckets)
+            out[model] = {
+                "attempts": attempts,
+                "refusal_rate": sum(b["refusals"] for b in buckets) / attempts if attempts else None,
+                "empty_rate": sum(b["empties"] for b in buckets) / attempts if attempts else None,
+            }
+        return out
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r") as file:
+                state = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"[router] Ignoring unreadable state file {self.path}: {e}")
+            return
+        if state.get("n_features") != N_FEATURES:
+            return
+        self.stats = state.get("stats", {})
+        self.weights = state.get("weights", {})
+        self.bias = state.get("bias", {})
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        parts = ("stats", "weights", "bias")
+
+        def merge(on_disk):
+            if on_disk.get("n_features") != N_FEATURES:
+                on_disk = {}
+            state = {"n_features": N_FEATURES}
+            for part in parts:
+                ours = getattr(self, part)
+                state[part] = dict(on_disk.get(part, {}), **{m: ours[m] for m in self._dirty if m in ours})
+            return state
+
+        saved = update_json(self.path, merge)
+        for part in parts:
+            getattr(self, part).update({m: v for m, v in saved[part].items() if m not in self._dirty})
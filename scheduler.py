@@ -0,0 +1,315 @@
+"""Client-side scheduling of requests to a shared LM Studio backend.
+
+Every chat.completions.create call waits for a slot before it is sent. Slots
+are handed out by priority class first (interactive turns, then follow-ups
+after tool results, then batch work) and round-robin between sessions within
+a class, so one busy session cannot starve the others. At most
+max_in_flight requests run at once; set it to what the GPU can serve in
+parallel.
+
+Scripts in separate processes can share the cap and the priority order by
+pointing LMSTUDIO_SLOT_DIR at the same directory. Each in-flight request then
+also holds a lock on one of max_in_flight slot files there, and a request
+waiting for a slot leaves a locked ticket file named by priority and arrival
+time. Only the first live ticket may take a free slot, so an interactive turn
+in one script goes ahead of batch work queued by another. Tickets also carry
+their session, and each session touches a served-* file whenever it takes a
+slot; within a class the session served longest ago goes first, oldest ticket
+first, so round-robin between sessions holds across processes too. Tickets of
+processes that died are removed.
+
+Environment variables:
+    LMSTUDIO_MAX_IN_FLIGHT   concurrent requests allowed (default 4)
+    LMSTUDIO_SLOT_DIR        directory for cross-process slot locks (optional)
+    LMSTUDIO_SCHED_REPORT    print queue metrics at exit when set
+"""
+import atexit
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from types import SimpleNamespace
+
+from budget import percentile
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; the slot directory is ignored there
+    fcntl = None
+
+INTERACTIVE = 0
+FOLLOW_UP = 1
+BATCH = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", FOLLOW_UP: "follow_up", BATCH: "batch"}
+
+WAIT_SAMPLES = 1000  # recent wait times kept per class for percentiles
+
+
+class _Ticket:
+    __slots__ = ("priority", "session", "enqueued")
+
+    def __init__(self, priority: int, session: str):
+        self.priority = priority
+        self.session = session
+        self.enqueued = time.perf_counter()
+
+
+class RequestScheduler:
+    """Priority classes with per-session round-robin and a cap on in-flight requests."""
+
+    def __init__(self, max_in_flight: int = 4, slot_dir: str = None):
+        self.max_in_flight = max(1, max_in_flight)
+        self.slot_dir = slot_dir if fcntl else None
+        if self.slot_dir:
+            os.makedirs(self.slot_dir, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._local = threading.local()  # per-thread time spent holding a slot, see slot_seconds()
+        self._queues = {p: OrderedDict() for p in PRIORITY_NAMES}
+        self._admitted = 0  # past this process's queue, including any still waiting for a cross-process slot
+        self._in_flight = 0
+        self._stats = {
+            p: {"submitted": 0, "started": 0, "completed": 0, "max_depth": 0, "wait_total": 0.0, "waits": deque(maxlen=WAIT_SAMPLES)}
+            for p in PRIORITY_NAMES
+        }
+
+    def _depth(self, priority: int) -> int:
+        return sum(len(q) for q in self._queues[priority].values())
+
+    def _head(self):
+        for priority in PRIORITY_NAMES:
+            sessions = self._queues[priority]
+            if sessions:
+                return sessions[next(iter(sessions))][0]
+        return None
+
+    def acquire(self, priority: int = INTERACTIVE, session: str = "default"):
+        """Block until this request may run; returns a token to pass to release()."""
+        ticket = _Ticket(priority, session)
+        with self._cond:
+            sessions = self._queues[priority]
+            sessions.setdefault(session, deque()).append(ticket)
+            stats = self._stats[priority]
+            stats["submitted"] += 1
+            stats["max_depth"] = max(stats["max_depth"], self._depth(priority))
+
+            try:
+                while not (self._admitted < self.max_in_flight and self._head() is ticket):
+                    self._cond.wait()
+            except BaseException:
+                # Interrupted while queued (e.g. Ctrl-C cancelling a turn): leave without taking a slot
+                queue = sessions[session]
+                queue.remove(ticket)
+                if not queue:
+                    del sessions[session]
+                self._cond.notify_all()
+                raise
+
+            queue = sessions[session]
+            queue.popleft()
+            if queue:
+                sessions.move_to_end(session)  # next turn in this class goes to another session
+            else:
+                del sessions[session]
+            self._admitted += 1
+            self._cond.notify_all()
+
+        try:
+            slot = self._lock_slot(priority, session) if self.slot_dir else None
+        except BaseException:
+            with self._cond:
+                self._admitted -= 1
+                self._cond.notify_all()
+            raise
+
+        # Only now is the request running, after any wait behind other processes
+        with self._cond:
+            self._in_flight += 1
+            waited = time.perf_counter() - ticket.enqueued
+            stats["started"] += 1
+            stats["wait_total"] += waited
+            stats["waits"].append(waited)
+        return ticket, slot
+
+    def release(self, token) -> None:
+        ticket, slot = token
+        if slot is not None:
+            fcntl.flock(slot, fcntl.LOCK_UN)
+            slot.close()
+        with self._cond:
+            self._admitted -= 1
+            self._in_flight -= 1
+            self._stats[ticket.priority]["completed"] += 1
+            self._cond.notify_all()
+
+    def _served_at(self, session: str) -> int:
+        try:
+            return os.stat(os.path.join(self.slot_dir, f"served-{session}")).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def _ticket_order(self, name: str):
+        # ticket-{priority}-{arrival}-{pid}-{thread}-{session}
+        parts = name.split("-", 5)
+        served = self._served_at(parts[5]) if len(parts) == 6 else 0
+        return int(parts[1]), served, parts[2]
+
+    def _first_ticket(self) -> str:
+        """Name of the first live ticket in the slot directory (priority, session served longest ago, arrival time)."""
+        for name in sorted((n for n in os.listdir(self.slot_dir) if n.startswith("ticket-")), key=self._ticket_order):
+            path = os.path.join(self.slot_dir, name)
+            try:
+                with open(path, "r") as ticket:
+                    fcntl.flock(ticket, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except FileNotFoundError:
+                continue
+            except OSError:
+                return name  # locked, so its owner is still waiting
+            # Nobody holds it: the process that queued it has died
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return ""
+
+    def _lock_slot(self, priority: int, session: str):
+        session = re.sub(r"[^A-Za-z0-9_.]", "_", session)
+        # The ticket is locked before it gets its visible name, so it is never mistaken for a dead one
+        name = f"ticket-{priority}-{time.time_ns():020d}-{os.getpid()}-{threading.get_ident()}-{session}"
+        pending_path = os.path.join(self.slot_dir, "." + name)
+        ticket = open(pending_path, "w")
+        fcntl.flock(ticket, fcntl.LOCK_EX)
+        os.rename(pending_path, os.path.join(self.slot_dir, name))
+        try:
+            while True:
+                if self._first_ticket() == name:
+                    for i in range(self.max_in_flight):
+                        slot = open(os.path.join(self.slot_dir, f"slot{i}.lock"), "a")
+                        try:
+                            fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                            # Sends this session's other tickets behind those of sessions served earlier
+                            served = os.path.join(self.slot_dir, f"served-{session}")
+                            open(served, "a").close()
+                            os.utime(served)
+                            return slot
+                        except OSError:
+                            slot.close()
+                time.sleep(0.05)
+        finally:
+            os.remove(os.path.join(self.slot_dir, name))
+            ticket.close()
+
+    def run(self, fn, priority: int = INTERACTIVE, session: str = "default", stream: bool = False):
+        """Call fn() once a slot is free. A streamed result holds its slot until fully consumed."""
+        token = self.acquire(priority, session)
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except BaseException:
+            self.release(token)
+            raise
+        if stream:
+            return HeldStream(result, lambda: self.release(token))
+        self.release(token)
+        self._local.seconds = self.slot_seconds() + time.perf_counter() - started
+        return result
+
+    def slot_seconds(self) -> float:
+        """Total time this thread's non-streamed requests have run after getting their slot.
+
+        Take the difference around a call to time just its generation, without
+        the time it spent queued.
+        """
+        return getattr(self._local, "seconds", 0.0)
+
+    def metrics(self) -> dict:
+        """Queue depth and wait-time statistics per priority class."""
+        with self._cond:
+            out = {"in_flight": self._in_flight, "max_in_flight": self.max_in_flight}
+            for priority, name in PRIORITY_NAMES.items():
+                stats = self._stats[priority]
+                waits = sorted(stats["waits"])
+                out[name] = {
+                    "queued": self._depth(priority),
+                    "max_depth": stats["max_depth"],
+                    "submitted": stats["submitted"],
+                    "completed": stats["completed"],
+                    "mean_wait_s": stats["wait_total"] / stats["started"] if stats["started"] else 0.0,
+                    "p95_wait_s": percentile(waits, 0.95) if waits else 0.0,
+                    "max_wait_s": waits[-1] if waits else 0.0,
+                }
+            return out
+
+    def report(self) -> str:
+        m = self.metrics()
+        lines = [f"[scheduler] in flight {m['in_flight']}/{m['max_in_flight']}"]
+        for name in PRIORITY_NAMES.values():
+            c = m[name]
+            if c["submitted"]:
+                lines.append(
+                    f"  {name:<12} {c['completed']}/{c['submitted']} done, queued {c['queued']} (max {c['max_depth']}), "
+                    f"wait mean {c['mean_wait_s'] * 1000:.0f}ms p95 {c['p95_wait_s'] * 1000:.0f}ms max {c['max_wait_s'] * 1000:.0f}ms"
+                )
+        return "\n".join(lines)
+
+
+class HeldStream:
+    """Iterates a streamed response and releases its slot once, when done, closed or collected."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self.close()
+
+    def close(self):
+        release, self._release = self._release, None
+        if release:
+            if hasattr(self._stream, "close"):
+                self._stream.close()
+            release()
+
+    def __del__(self):
+        self.close()
+
+
+class _ScheduledCompletions:
+    def __init__(self, inner, scheduler: RequestScheduler, session: str):
+        self._inner = inner
+        self._scheduler = scheduler
+        self._session = session
+
+    def create(self, priority: int = INTERACTIVE, session: str = None, **kwargs):
+        return self._scheduler.run(
+            lambda: self._inner.create(**kwargs),
+            priority=priority,
+            session=session or self._session,
+            stream=bool(kwargs.get("stream")),
+        )
+
+
+class ScheduledClient:
+    """Wraps a client so chat.completions.create(priority=..., session=...) goes through a scheduler."""
+
+    def __init__(self, client, scheduler: RequestScheduler, session: str):
+        self._client = client
+        self.scheduler = scheduler
+        self.session = session
+        self.chat = SimpleNamespace(completions=_ScheduledCompletions(client.chat.completions, scheduler, session))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+default_scheduler = RequestScheduler(
+    max_in_flight=int(os.environ.get("LMSTUDIO_MAX_IN_FLIGHT", "4")),
+    slot_dir=os.environ.get("LMSTUDIO_SLOT_DIR"),
+)
+
+if os.environ.get("LMSTUDIO_SCHED_REPORT"):
+    atexit.register(lambda: print(default_scheduler.report()))
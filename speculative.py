@@ -0,0 +1,224 @@
+"""Speculative decoding with a small draft model of the same family.
+
+LM Studio accepts a "draft_model" field on chat completions: the draft model
+proposes tokens and the main model only verifies them, which speeds up
+generation when the two share a tokenizer and the draft guesses well.
+
+SpeculativeClient adds the field for models listed in a script's
+DRAFT_MODELS mapping, which is empty (drafting off) unless set, e.g.
+DRAFT_MODELS = {"qwen3-8b": "unfilteredai_dan-qwen3-1.7b"} in multi.py
+or thejeff.py. Each pair is checked locally first: both names must
+belong to the same model family (so they share a tokenizer) and the draft
+must be the smaller model. If the server rejects a request that carried a
+draft model, the request is retried without it and drafting stays off for
+that model for the rest of the session.
+
+    python speculative.py --bench                        # qwen3-8b with and without its draft
+    python speculative.py --bench --model qwen3-8b --draft unfilteredai_dan-qwen3-1.7b --runs 5
+
+Acceptance counts come from the "stats" object LM Studio adds to responses
+(accepted_draft_tokens_count / total_draft_tokens_count); servers that do
+not return it are reported without an acceptance rate.
+
+    LMSTUDIO_DRAFT_REPORT   print drafted requests and acceptance at exit when set
+"""
+import argparse
+import atexit
+import os
+import re
+import statistics
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, Optional, Tuple
+
+# Families whose members share a tokenizer, matched against the model name in order
+MODEL_FAMILIES = [
+    ("qwen3", re.compile(r"qwen-?3(?![.\d])", re.I)),
+    ("qwen2.5", re.compile(r"qwen-?2\.5", re.I)),
+    ("llama-3", re.compile(r"llama-?3", re.I)),
+    ("gemma-3", re.compile(r"gemma-?3", re.I)),
+    ("gpt-oss", re.compile(r"gpt-oss", re.I)),
+]
+_SIZE = re.compile(r"(?<![a-z\d.])(\d+(?:\.\d+)?)b\b", re.I)  # "8b", "1.7b"; skips MoE "a3b"
+
+
+def model_family(name: str) -> Optional[str]:
+    for family, pattern in MODEL_FAMILIES:
+        if pattern.search(name):
+            return family
+    return None
+
+
+def model_size(name: str) -> Optional[float]:
+    """Parameter count in billions parsed from the model name, if present."""
+    match = _SIZE.search(name)
+    return float(match.group(1)) if match else None
+
+
+def check_draft(model: str, draft: str) -> Tuple[bool, str]:
+    """Whether draft can serve as the draft model for model, with the reason if not."""
+    if draft == model:
+        return False, "draft is the same model"
+    family, draft_family = model_family(model), model_family(draft)
+    if family is None or draft_family is None:
+        return False, "unknown model family, cannot tell whether the tokenizers match"
+    if family != draft_family:
+        return False, f"different families ({family} vs {draft_family})"
+    size, draft_size = model_size(model), model_size(draft)
+    if size is not None and draft_size is not None and draft_size >= size:
+        return False, f"draft ({draft_size:g}B) is not smaller than the model ({size:g}B)"
+    return True, ""
+
+
+def draft_stats(response) -> Tuple[Optional[int], Optional[int]]:
+    """(accepted, total) draft tokens from the response's stats, if the server sent them."""
+    stats = getattr(response, "stats", None)
+    if stats is None:
+        stats = (getattr(response, "model_extra", None) or {}).get("stats")
+    if stats is None:
+        return None, None
+    get = stats.get if isinstance(stats, dict) else lambda key: getattr(stats, key, None)
+    return get("accepted_draft_tokens_count"), get("total_draft_tokens_count")
+
+
+class SpeculativeClient:
+    """Client wrapper that adds a draft model to requests for the configured models."""
+
+    def __init__(self, client, draft_models: Dict[str, str]):
+        self.client = client
+        self.draft_models = {}
+        for model, draft in (draft_models or {}).items():
+            ok, reason = check_draft(model, draft)
+            if ok:
+                self.draft_models[model] = draft
+            else:
+                print(f"[draft] Not using {draft} as draft for {model}: {reason}")
+        self.rejected = set()
+        self.requests = 0
+        self.fallbacks = 0
+        self.accepted = 0
+        self.drafted = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def create(self, **kwargs):
+        model = kwargs.get("model")
+        draft = self.draft_models.get(model)
+        if draft is None or model in self.rejected:
+            return self.client.chat.completions.create(**kwargs)
+
+        extra_body = dict(kwargs.get("extra_body") or {}, draft_model=draft)
+        try:
+            response = self.client.chat.completions.create(**dict(kwargs, extra_body=extra_body))
+        except Exception as e:
+            # 5xx and connection errors are not about the draft model
+            if not 400 <= getattr(e, "status_code", 500) < 500:
+                raise
+            response = self.client.chat.completions.create(**kwargs)
+            # Only blame the draft model once the same request succeeds without it
+            with self._lock:
+                self.rejected.add(model)
+                self.fallbacks += 1
+            print(f"[draft] Server rejected draft model {draft} for {model}, continuing without it: {e}")
+            return response
+
+        accepted, total = draft_stats(response)
+        with self._lock:
+            self.requests += 1
+            if total:
+                self.accepted += accepted or 0
+                self.drafted += total
+        return response
+
+    def report(self) -> str:
+        acceptance = f"{self.accepted / self.drafted:.0%} of {self.drafted} draft tokens accepted" if self.drafted else "no acceptance stats"
+        pairs = ", ".join(f"{model} <- {draft}" for model, draft in sorted(self.draft_models.items())) or "none"
+        return (
+            f"[draft] pairs: {pairs}; {self.requests} drafted requests, {acceptance}; "
+            f"{self.fallbacks} fallbacks (disabled for: {', '.join(sorted(self.rejected)) or 'none'})"
+        )
+
+    def report_at_exit(self) -> None:
+        if os.environ.get("LMSTUDIO_DRAFT_REPORT"):
+            atexit.register(lambda: print(self.report()))
+
+
+BENCH_PROMPTS = [
+    "Explain how a hash table handles collisions, with a short Python example.",
+    "Write a 200-word scene set in a crowded night market.",
+    "List ten practical tips for keeping a small vegetable garden healthy.",
+]
+
+
+def bench(client, model: str, draft: str, runs: int, max_tokens: int) -> None:
+    """Compare generation speed and acceptance with and without the draft model."""
+    ok, reason = check_draft(model, draft)
+    if not ok:
+        print(f"Warning: {draft} does not look like a valid draft for {model}: {reason}")
+
+    rows = []
+    for label, extra_body in (("no draft", None), (f"draft {draft}", {"draft_model": draft})):
+        speeds, accepted, drafted, errors = [], 0, 0, 0
+        for _ in range(runs):
+            for prompt in BENCH_PROMPTS:
+                kwargs = {
+                    "model": model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "max_tokens": max_tokens,
+                    "temperature": 0,
+                }
+                if extra_body:
+                    kwargs["extra_body"] = extra_body
+                started = time.perf_counter()
+                try:
+                    response = client.chat.completions.create(**kwargs)
+                except Exception as e:
+                    errors += 1
+                    print(f"  {label}: request failed: {e}")
+                    continue
+                elapsed = time.perf_counter() - started
+                tokens = response.usage.completion_tokens if response.usage else 0
+                if tokens and elapsed > 0:
+                    speeds.append(tokens / elapsed)
+                a, t = draft_stats(response)
+                if t:
+                    accepted += a or 0
+                    drafted += t
+        rows.append((label, speeds, accepted, drafted, errors))
+
+    print(f"\n{model}: {runs} x {len(BENCH_PROMPTS)} prompts, max_tokens={max_tokens}")
+    print(f"{'':<48} {'tok/s p50':>9} {'mean':>7} {'accepted':>9} {'errors':>6}")
+    for label, speeds, accepted, drafted, errors in rows:
+        p50 = f"{statistics.median(speeds):.1f}" if speeds else "-"
+        mean = f"{statistics.mean(speeds):.1f}" if speeds else "-"
+        rate = f"{accepted / drafted:.0%}" if drafted else "-"
+        print(f"{label[:48]:<48} {p50:>9} {mean:>7} {rate:>9} {errors:>6}")
+    base, spec = rows[0][1], rows[1][1]
+    if base and spec:
+        print(f"Speed-up with draft: {statistics.median(spec) / statistics.median(base):.2f}x")
+
+
+def main():
+    from openai import OpenAI
+
+    parser = argparse.ArgumentParser(description="Speculative decoding checks and benchmark")
+    parser.add_argument("--base-url", default=os.environ.get("LMSTUDIO_BASE_URL", "http://localhost:1234/v1"))
+    parser.add_argument("--model", default="qwen3-8b")
+    parser.add_argument("--draft", default="unfilteredai_dan-qwen3-1.7b")
+    parser.add_argument("--bench", action="store_true", help="Compare tokens/sec and acceptance with and without the draft")
+    parser.add_argument("--runs", type=int, default=3, help="Passes over the benchmark prompts")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    args = parser.parse_args()
+
+    ok, reason = check_draft(args.model, args.draft)
+    print(f"{args.draft} as draft for {args.model}: {'compatible' if ok else 'incompatible, ' + reason}")
+    if args.bench:
+        bench(OpenAI(base_url=args.base_url, api_key="lm-studio"), args.model, args.draft, args.runs, args.max_tokens)
+
+
+if __name__ == "__main__":
+    main()
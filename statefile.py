@@ -0,0 +1,39 @@
+"""Learned-state JSON files shared by several scripts running at once.
+
+Each script keeps its learned state (budgets, router statistics) in memory
+and saves it after every update. Rewriting the whole file from memory would
+drop whatever another process saved in the meantime, so update_json() reads
+the file under an exclusive lock, lets the caller merge its changes into
+what is on disk, and writes the result back atomically.
+"""
+import json
+import os
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; saves there are not serialised between processes
+    fcntl = None
+
+
+def read_json(path: str) -> dict:
+    """The file's JSON object, or {} if it is missing or unreadable."""
+    try:
+        with open(path, "r") as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def update_json(path: str, merge: Callable[[dict], dict]) -> dict:
+    """Replace the file with merge(current contents) while holding its lock; returns what was written."""
+    with open(path + ".lock", "a") as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        state = merge(read_json(path))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(state, file)
+        os.replace(tmp_path, path)
+    return state
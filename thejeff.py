@@ -1,13 +1,59 @@
 import yaml
 import random
 import json
-from openai import OpenAI
-from typing import Dict, List, Optional
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import SimpleNamespace
+from lmclient import make_client
+from cassette import cassette_active
+from scheduler import BATCH, FOLLOW_UP
+from budget import BudgetController, CHAOS, NARRATION, OPENING, PRIVATE_NARRATION
+from reasoning import ReasoningStats, ReasoningStream, no_think, strip_reasoning
+from chatloop import ChatLoop
+from typing import Dict, List, Optional, Tuple
 
-# Initialize OpenAI client for LM Studio
-client = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
 model = "qwen/qwen3-8b"
 
+# Speculative decoding for the GM with a small qwen3 draft model (see speculative.py). Off by default;
+# e.g. {model: "unfilteredai_dan-qwen3-1.7b"} to turn it on (the draft must be loaded on the server too).
+DRAFT_MODELS = {}
+
+# Initialize OpenAI client for LM Studio
+client = make_client(draft_models=DRAFT_MODELS)
+
+# Learned max_tokens/stop budgets per turn type (see budget.py)
+BUDGET_STATE_PATH = "budget_state.json"
+generation_budget = BudgetController(BUDGET_STATE_PATH, frozen=cassette_active())
+generation_budget.report_at_exit()
+
+# qwen3 reasoning: <think> blocks are stripped from GM replies, and the narration
+# after tool results is a fast turn (the GM already reasoned when calling the tools)
+FAST_TOOL_FOLLOW_UPS = True
+reasoning_stats = ReasoningStats()
+reasoning_stats.report_at_exit()
+
+# Private narration: after each public GM reply every node gets its own view,
+# generated concurrently from the shared public history and written to its own file
+PRIVATE_NARRATION_ENABLED = True
+PRIVATE_NARRATION_DIR = "private_views"
+PRIVATE_NARRATION_FAST = True  # skip qwen3 reasoning for private views
+PRIVATE_NARRATION_CONCURRENT = True  # False generates the views one after another (for comparison)
+PRIVATE_TOOL_NAMES = {"update_faction_slider", "update_chaos_counter", "update_alien_exposure"}
+
+# Pipelined startup: the opening narration streams while dice are rolled, and the
+# first private views plus a cache-warming prefetch of the next GM call run while
+# the first player types. The first turn waits for the views only; the prefetch is
+# skipped if input arrives first. False runs the same steps one after another.
+PIPELINED_STARTUP = True
+
+# Read input on its own thread so the table can type while the GM narrates (see chatloop.py);
+# actions typed during one narration are merged into a single GM call. Ctrl-C cancels a narration.
+TYPE_AHEAD = True
+MERGE_QUEUED_MESSAGES = True
+
 # Game state variables
 game_state = {
     "faction_slider": 0,  # -5 (Earthbound) to 5 (Homeward)
@@ -49,15 +95,14 @@ def load_players() -> List[Dict]:
             file.write(PLAYER_SCHEMA)
         return yaml.safe_load(PLAYER_SCHEMA)["players"]
 
-def roll_d6()::Dict{String, Any}
+def roll_d6() -> Dict:
     """Simulate a D6 die roll"""
-    result = rand(1:6)
-    return Dict(
-        "status" => "success",
-        "roll" => result,
-        "description" => "D6 roll result: $result"
-    )
-end
+    result = random.randint(1, 6)
+    return {
+        "status": "success",
+        "roll": result,
+        "description": f"D6 roll result: {result}"
+    }
 
 def update_faction_slider(direction: str, amount: int = 1) -> Dict:
     """Update faction alignment slider and check for extreme events"""
@@ -179,6 +224,21 @@ GAME LOOP: Narrate the current situation based on player actions. Remember:
 - After failed actions or completed goals, request bidding for next player
 """
 
+def narration_turn_type() -> str:
+    """Budget turn type for the next GM narration"""
+    return CHAOS if game_state["chaos_mode"] else NARRATION
+
+def player_stop_sequences() -> List[str]:
+    """Stop the GM if it starts writing the current player's next line"""
+    if not game_state["current_player"]:
+        return []
+    return [f"\n{game_state['current_player']}:"]
+
+def record_reasoning(response, reasoning_text: str, elapsed: float, fast: bool = False):
+    """Add a GM reply's stripped reasoning to the session statistics"""
+    usage = getattr(response, "usage", None)
+    reasoning_stats.record(reasoning_text, getattr(usage, "completion_tokens", None), elapsed, fast=fast)
+
 def get_player_secrets() -> str:
     """Generate hidden player information for GM"""
     secrets = "PLAYER SECRETS (GM ONLY):\n"
@@ -267,6 +327,18 @@ tools = [
     },
 ]
 
+def execute_tool(func_name: str, args: Dict) -> Optional[Dict]:
+    """Run one game tool, returning None for unknown tools"""
+    if func_name == "roll_d6":
+        return roll_d6()
+    elif func_name == "update_faction_slider":
+        return update_faction_slider(args.get("direction"), args.get("amount", 1))
+    elif func_name == "update_chaos_counter":
+        return update_chaos_counter(args.get("amount", 1))
+    elif func_name == "update_alien_exposure":
+        return update_alien_exposure(args.get("amount", 1))
+    return None
+
 def process_tool_calls(response, messages):
     """Process tool calls and update game state"""
     tool_calls = response.choices[0].message.tool_calls
@@ -293,15 +365,8 @@ def process_tool_calls(response, messages):
         args = json.loads(tool_call.function.arguments) if tool_call.function.arguments else {}
         
         # Execute the appropriate function
-        if func_name == "roll_d6":
-            result = roll_d6()
-        elif func_name == "update_faction_slider":
-            result = update_faction_slider(args.get("direction"), args.get("amount", 1))
-        elif func_name == "update_chaos_counter":
-            result = update_chaos_counter(args.get("amount", 1))
-        elif func_name == "update_alien_exposure":
-            result = update_alien_exposure(args.get("amount", 1))
-        else:
+        result = execute_tool(func_name, args)
+        if result is None:
             continue
         
         # Add tool result to messages
@@ -312,18 +377,199 @@ def process_tool_calls(response, messages):
         })
     
     # Get final response after tool calls
-    return client.chat.completions.create(
+    reasoning_stats.request_sent()
+    return generation_budget.create(
+        client,
+        narration_turn_type(),
+        stop=player_stop_sequences(),
+        model=model,
+        messages=no_think(messages) if FAST_TOOL_FOLLOW_UPS else messages,
+        tools=tools,
+        priority=FOLLOW_UP,
+    )
+
+def private_prompt(player: Dict) -> str:
+    """Instruction appended to the shared public history for one node's private view"""
+    return f"""PRIVATE VIEW FOR {player['name']} ONLY (other nodes never see this).
+In at most 120 words, tell {player['name']} what their node privately notices in the scene above:
+details relevant to their hidden skill ({player['alien_skill']}; {', '.join(player['mundane_skills'])})
+and their secret goals, without naming the goals. Never reveal other nodes' secrets.
+If this private perception changes the game state, call the update tools; otherwise just narrate."""
+
+def run_private_view(messages: List[Dict], player: Dict) -> Dict:
+    """Generate one node's private narration; proposed state changes are returned, not applied"""
+    private_messages = messages + [{"role": "user", "content": private_prompt(player)}]
+    started = client.scheduler.slot_seconds()
+    reasoning_stats.request_sent()
+    response = generation_budget.create(
+        client,
+        PRIVATE_NARRATION,
+        model=model,
+        messages=no_think(private_messages) if PRIVATE_NARRATION_FAST else private_messages,
+        tools=tools,  # the GM's full list keeps the prompt prefix cached; other calls are dropped below
+        priority=FOLLOW_UP,
+        session=f"{client.session}-{player['name']}",  # views take turns with each other and the GM's follow-ups
+    )
+    elapsed = client.scheduler.slot_seconds() - started  # generation only, not the wait for a slot
+
+    message = response.choices[0].message
+    text, reasoning_text = strip_reasoning(message.content)
+    record_reasoning(response, reasoning_text, elapsed, fast=PRIVATE_NARRATION_FAST)
+
+    proposed = []
+    for tool_call in message.tool_calls or []:
+        if tool_call.function.name not in PRIVATE_TOOL_NAMES:
+            continue
+        try:
+            args = json.loads(tool_call.function.arguments) if tool_call.function.arguments else {}
+        except json.JSONDecodeError:
+            continue
+        proposed.append((tool_call.function.name, args))
+    return {"player": player["name"], "text": text, "proposed": proposed, "elapsed": elapsed}
+
+def private_narration_phase(messages: List[Dict]) -> Optional[str]:
+    """Run every node's private view (concurrently by default) and merge state changes in roster order"""
+    players = game_state["players"]
+    if not PRIVATE_NARRATION_ENABLED or not players:
+        return None
+
+    started = time.perf_counter()
+    views = []
+    if PRIVATE_NARRATION_CONCURRENT:
+        executor = ThreadPoolExecutor(max_workers=len(players))
+        try:
+            futures = [executor.submit(run_private_view, list(messages), player) for player in players]
+            for player, future in zip(players, futures):
+                try:
+                    views.append(future.result())
+                except Exception as e:
+                    print(f"[PRIVATE] View for {player['name']} failed: {e}")
+        except KeyboardInterrupt:
+            # Ctrl-C: drop views not started yet and don't wait for the ones generating
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+    else:
+        for player in players:
+            try:
+                views.append(run_private_view(list(messages), player))
+            except Exception as e:
+                print(f"[PRIVATE] View for {player['name']} failed: {e}")
+    wall_time = time.perf_counter() - started
+
+    # Apply proposed changes in roster order, then call order, so the result never depends on timing
+    # Who caused a change stays in that player's file; the table only sees how many happened
+    os.makedirs(PRIVATE_NARRATION_DIR, exist_ok=True)
+    changes = 0
+    for view in views:
+        lines = [f"\n--- {time.strftime('%H:%M:%S')} ---", view["text"]]
+        for func_name, args in view["proposed"]:
+            result = execute_tool(func_name, args)
+            changes += 1
+            lines.append(f"[{func_name}({json.dumps(args)}) -> {json.dumps(result)}]")
+        with open(os.path.join(PRIVATE_NARRATION_DIR, f"{view['player']}.txt"), "a") as file:
+            file.write("\n".join(lines) + "\n")
+
+    if PRIVATE_NARRATION_CONCURRENT:
+        # Each view's time after getting its slot, added up: what generating them one after another takes
+        mode = f"concurrent; {sum(view['elapsed'] for view in views):.1f}s of generation, the sequential baseline"
+    else:
+        mode = "sequential"
+    return (f"\n[PRIVATE] {len(views)} private views written to {PRIVATE_NARRATION_DIR}/, {changes} hidden state changes, "
+            f"{wall_time:.1f}s ({mode})")
+
+def stream_opening(messages: List[Dict], chunks: queue.Queue):
+    """Stream the opening narration into a queue; runs on its own thread"""
+    try:
+        reasoning_stats.request_sent()
+        stream = generation_budget.create(
+            client,
+            OPENING,
+            model=model,
+            messages=messages,
+            tools=tools,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for chunk in stream:
+            chunks.put(chunk)
+    except Exception as e:
+        chunks.put(e)
+    chunks.put(None)
+
+def print_opening(chunks: queue.Queue, started: float, max_tokens: int) -> Tuple[str, str]:
+    """Print the streamed opening without its reasoning, record it like a finished reply and return (content, reasoning)"""
+    print("\nGM: ", end="", flush=True)
+    filtered = ReasoningStream()
+    parts = []
+    finish_reason = None
+    usage = None
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            break
+        if isinstance(chunk, Exception):
+            raise chunk
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        finish_reason = chunk.choices[0].finish_reason or finish_reason
+        text = chunk.choices[0].delta.content or ""
+        parts.append(text)
+        print(filtered.feed(text), end="", flush=True)
+    print(filtered.close())
+
+    elapsed = time.perf_counter() - started
+    opening_content, reasoning_text = strip_reasoning("".join(parts))
+    response = SimpleNamespace(
+        choices=[SimpleNamespace(finish_reason=finish_reason, message=SimpleNamespace(content="".join(parts)))],
+        usage=usage,
+    )
+    generation_budget.observe(OPENING, model, response, elapsed, max_tokens)
+    record_reasoning(response, reasoning_text, elapsed)
+    return opening_content, reasoning_text
+
+def prefetch_next_turn(messages: List[Dict]):
+    """Send the next GM call's prompt with max_tokens=1 so the server caches it while the player types"""
+    client.chat.completions.create(
         model=model,
         messages=messages,
         tools=tools,
+        max_tokens=1,
+        priority=BATCH,
     )
 
-def start_game():
+def after_opening(messages: List[Dict]) -> Optional[str]:
+    """Private views for the opening, then the prefetch so it is the last prompt the server saw"""
+    summary = private_narration_phase(messages)
+    try:
+        prefetch_next_turn(messages)
+    except Exception as e:
+        print(f"\n[STARTUP] Prefetch failed: {e}")
+    return summary
+
+def prefetch_after_views(views: Future, messages: List[Dict], input_arrived: threading.Event):
+    """Prefetch once the startup views are done, unless the first turn's input came first and made it redundant"""
+    try:
+        views.result()
+    except Exception:
+        pass  # reported by the first turn
+    if input_arrived.is_set():
+        return
+    try:
+        prefetch_next_turn(messages)
+    except Exception as e:
+        print(f"\n[STARTUP] Prefetch failed: {e}")
+
+def start_game(on_roster_loaded=None):
     """Initialize game state and start the game"""
     global game_state
     
     # Load players
     game_state["players"] = load_players()
+    if on_roster_loaded:
+        on_roster_loaded()
     
     # Determine starting player
     game_state["current_player"] = determine_starting_player()
@@ -337,50 +583,120 @@ def start_game():
 def chat():
     """Main game loop"""
     messages = []
+    startup = time.perf_counter()
+    
+    # The opening uses the GAME START prompt, so it is built once the roster is
+    # known but before a starting player is chosen
+    opening_messages = []
+    opening_chunks = queue.Queue()
+    opening_max_tokens = generation_budget.max_tokens(OPENING, model)
+    
+    def begin_opening():
+        opening_messages.append({"role": "system", "content": get_system_prompt() + "\n\n" + get_player_secrets()})
+        if PIPELINED_STARTUP:
+            threading.Thread(target=stream_opening, args=(opening_messages, opening_chunks), daemon=True).start()
     
     # Start the game
-    start_game()
+    started = time.perf_counter()
+    start_game(begin_opening)
+    if not PIPELINED_STARTUP:
+        started = time.perf_counter()
+        stream_opening(opening_messages, opening_chunks)
+    opening_content, opening_reasoning = print_opening(opening_chunks, started, opening_max_tokens)
     
-    # Initial system prompt
+    # Later turns use the GAME LOOP prompt
     system_prompt = get_system_prompt() + "\n\n" + get_player_secrets()
     messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "assistant", "content": opening_content})
+    reasoning_stats.kept_out(opening_reasoning)
     
-    print("\nGM: " + client.chat.completions.create(
-        model=model,
-        messages=messages,
-        tools=tools,
-    ).choices[0].message.content)
+    pending_startup = None
+    input_arrived = threading.Event()
+    if PIPELINED_STARTUP:
+        # The views also return when they finished, for the figure comparable to sequential startup.
+        # The prefetch is separate, so the first turn never waits for it
+        startup_executor = ThreadPoolExecutor(max_workers=2)
+        pending_startup = startup_executor.submit(
+            lambda m: (private_narration_phase(m), time.perf_counter()), list(messages)
+        )
+        startup_executor.submit(prefetch_after_views, pending_startup, list(messages), input_arrived)
+        startup_executor.shutdown(wait=False)
+        print(f"\n[STARTUP] First playable turn after {time.perf_counter() - startup:.1f}s "
+              f"(pipelined, startup private views still running)")
+    else:
+        summary = after_opening(messages)
+        if summary:
+            print(summary)
+        print(f"\n[STARTUP] First playable turn after {time.perf_counter() - startup:.1f}s "
+              f"(sequential, startup private views done)")
     
     # Main game loop
-    while True:
-        user_input = input(f"\n{current_player}: ").strip()
+    loop = ChatLoop(
+        lambda: f"\n{game_state['current_player']}: ",
+        quit_words=["quit", "exit"],
+        type_ahead=TYPE_AHEAD,
+        merge=MERGE_QUEUED_MESSAGES,
+    )
+    
+    def respond(messages, user_input):
+        nonlocal pending_startup
+        input_arrived.set()
         
-        # Exit command
-        if user_input.lower() in ["quit", "exit"]:
-            print("GM: Game ended. Thanks for playing!")
-            break
+        # The first turn waits for the startup private views so their state changes apply first
+        if pending_startup is not None:
+            waiting = time.perf_counter()
+            try:
+                summary, finished = pending_startup.result()
+                if summary:
+                    print(summary)
+                print(f"[STARTUP] Startup private views done after {finished - startup:.1f}s "
+                      f"(compare with sequential); the first turn waited {time.perf_counter() - waiting:.1f}s for them")
+            except Exception as e:
+                print(f"\n[PRIVATE] Startup private views failed: {e}")
+            pending_startup = None
         
         # Add user message
         messages.append({"role": "user", "content": user_input})
         
         try:
             # Get response
-            response = client.chat.completions.create(
+            started = time.perf_counter()
+            generating = client.scheduler.slot_seconds()
+            reasoning_stats.request_sent()
+            response = generation_budget.create(
+                client,
+                narration_turn_type(),
+                stop=player_stop_sequences(),
                 model=model,
                 messages=messages,
                 tools=tools,
             )
             
             # Process tool calls if any
-            if response.choices[0].message.tool_calls:
+            used_tools = bool(response.choices[0].message.tool_calls)
+            if used_tools:
+                # Only the follow-up's tokens are counted, so time only its generation
+                generating = client.scheduler.slot_seconds()
                 response = process_tool_calls(response, messages)
             
-            # Get response content
-            response_content = response.choices[0].message.content
+            # Get response content, keeping reasoning out of the output and the history
+            response_content, reasoning_text = strip_reasoning(response.choices[0].message.content)
+            record_reasoning(response, reasoning_text, client.scheduler.slot_seconds() - generating,
+                             fast=used_tools and FAST_TOOL_FOLLOW_UPS)
             messages.append({"role": "assistant", "content": response_content})
+            reasoning_stats.kept_out(reasoning_text)
             
             # Print GM response with game state
             print(f"\nGM: {response_content}")
+            reply_time = time.perf_counter() - started
+            
+            # The table has seen the reply and its public state changes, so interrupting the private views keeps it
+            loop.commit()
+            summary = private_narration_phase(messages)
+            if summary:
+                print(summary)
+                turn_time = time.perf_counter() - started
+                print(f"[TURN] {turn_time:.1f}s total (GM reply {reply_time:.1f}s, private views {turn_time - reply_time:.1f}s)")
             print(f"\n[GAME STATE] Faction: {game_state['faction_slider']} | Chaos: {game_state['chaos_counter']}/10 | Exposure: {game_state['alien_exposure']}")
             
             # Handle chaos mode completion
@@ -390,6 +706,9 @@ def chat():
             
         except Exception as e:
             print(f"\nError: {str(e)}")
+    
+    loop.run(messages, respond)
+    print("GM: Game ended. Thanks for playing!")
 
 if __name__ == "__main__":
     chat()
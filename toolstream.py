@@ -0,0 +1,120 @@
+"""Assembly of streamed tool calls, executing each one as soon as it is complete.
+
+With stream=True the tool calls of a reply arrive as deltas: the first delta
+for an index carries the call id and function name, later ones append
+fragments of the JSON arguments. ToolCallAssembler collects them and submits
+a call to an executor as soon as its arguments parse as a JSON object, so a
+slow tool starts while the model is still emitting the remaining calls.
+
+Arguments that never parse are not executed; the call's result is an error
+the model can read and correct. Tool results are returned in call order
+whatever order the tools finish in.
+"""
+import json
+from concurrent.futures import Executor
+from typing import Callable, List, Optional, Tuple
+
+
+def parse_arguments(text: str) -> Tuple[Optional[dict], Optional[str]]:
+    """Parse tool-call arguments into (arguments, error); blank arguments are {}."""
+    if not text or not text.strip():
+        return {}, None
+    try:
+        arguments = json.loads(text)
+    except json.JSONDecodeError as e:
+        return None, f"Invalid JSON arguments: {e}"
+    if not isinstance(arguments, dict):
+        return None, "Tool arguments must be a JSON object"
+    return arguments, None
+
+
+class StreamedToolCall:
+    def __init__(self, index: int):
+        self.index = index
+        self.id = None
+        self.name = ""
+        self.arguments = ""
+        self.error = None
+        self.future = None
+
+    def as_message(self) -> dict:
+        """The call as it goes into the assistant message of the history."""
+        return {
+            "id": self.id,
+            "type": "function",
+            "function": {"name": self.name, "arguments": self.arguments},
+        }
+
+
+class ToolCallAssembler:
+    """Builds tool calls from stream deltas and starts each one once its arguments are complete.
+
+    execute(name, arguments) runs one tool and returns its result, or None for
+    an unknown tool.
+    """
+
+    def __init__(self, execute: Callable[[str, dict], Optional[dict]], executor: Executor):
+        self.execute = execute
+        self.executor = executor
+        self.calls = {}
+
+    def _submit(self, call: StreamedToolCall, arguments: dict) -> None:
+        call.future = self.executor.submit(self.execute, call.name, arguments)
+
+    def _try_start(self, call: StreamedToolCall) -> None:
+        # Only attempt a parse when the text could close the object, so long arguments are not re-parsed per fragment
+        if call.future is not None or not call.name or not call.arguments.rstrip().endswith("}"):
+            return
+        arguments, error = parse_arguments(call.arguments)
+        if error is None:
+            self._submit(call, arguments)
+
+    def _settle(self, call: StreamedToolCall) -> None:
+        """Start a call whose deltas have all arrived, or mark it malformed."""
+        if call.future is not None or call.error is not None:
+            return
+        arguments, error = parse_arguments(call.arguments)
+        if error is not None:
+            call.error = error
+        else:
+            self._submit(call, arguments)
+
+    def feed(self, tool_call_deltas) -> None:
+        """Add the tool_calls of one stream chunk's delta."""
+        for delta in tool_call_deltas or []:
+            index = getattr(delta, "index", None)
+            if index is None:
+                index = len(self.calls)
+            if index not in self.calls:
+                # A new index means every earlier call is finished
+                for call in self.calls.values():
+                    self._settle(call)
+                self.calls[index] = StreamedToolCall(index)
+            call = self.calls[index]
+            if getattr(delta, "id", None):
+                call.id = delta.id
+            function = getattr(delta, "function", None)
+            if function is not None:
+                call.name += getattr(function, "name", None) or ""
+                call.arguments += getattr(function, "arguments", None) or ""
+            self._try_start(call)
+
+    def finish(self) -> List[StreamedToolCall]:
+        """Settle the remaining calls at the end of the stream and return all of them in order."""
+        for call in self.calls.values():
+            self._settle(call)
+            call.id = call.id or f"call_{call.index}"  # some servers omit ids when streaming
+        return [self.calls[index] for index in sorted(self.calls)]
+
+    def results(self) -> List[Tuple[StreamedToolCall, Optional[dict]]]:
+        """Wait for every call and pair it with its result, in call order."""
+        results = []
+        for call in self.finish():
+            if call.error is not None:
+                results.append((call, {"status": "error", "message": call.error}))
+                continue
+            try:
+                results.append((call, call.future.result()))
+            except Exception as e:
+                results.append((call, {"status": "error", "message": str(e)}))
+        return results
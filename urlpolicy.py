@@ -0,0 +1,473 @@
+"""Domain allow/block policy used by open_safe_url.
+
+Lists are plain text files with one domain per line; blank lines and lines
+starting with '#' are ignored. An entry covers the domain itself and every
+subdomain of it, so "python.org" also allows "docs.python.org". When several
+entries match, the most specific one wins, and a domain that is on both lists
+is blocked. Domains that are not covered by any entry are denied.
+
+Public suffixes such as "co.uk" or "github.io" are never accepted as allowlist
+entries, otherwise a single line would open up every site registered under
+them. They can still be blocked outright.
+
+Large lists can be compiled into a flat hash table on disk and memory-mapped,
+so startup does not have to re-parse 10^6 lines:
+
+    python urlpolicy.py --compile allow.txt --block block.txt -o url_policy.cache
+    python urlpolicy.py --bench
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import random
+import re
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse, urlunparse
+
+ALLOW = 1
+BLOCK = 2
+
+# Multi-label public suffixes that are checked when no suffix list file is
+# loaded. Single labels ("com", "uk", ...) are always treated as public.
+PUBLIC_SUFFIXES = {
+    "ac.uk", "co.uk", "gov.uk", "ltd.uk", "me.uk", "net.uk", "org.uk", "plc.uk", "sch.uk",
+    "com.au", "edu.au", "gov.au", "net.au", "org.au",
+    "co.nz", "net.nz", "org.nz", "govt.nz",
+    "co.jp", "ne.jp", "or.jp", "ac.jp", "go.jp",
+    "co.kr", "or.kr", "co.in", "net.in", "org.in", "co.za", "org.za",
+    "com.br", "net.br", "org.br", "com.cn", "net.cn", "org.cn", "com.mx",
+    "com.sg", "com.tr", "com.tw", "com.hk", "com.ar", "co.il",
+    "github.io", "gitlab.io", "herokuapp.com", "netlify.app", "vercel.app",
+    "pages.dev", "workers.dev", "appspot.com", "blogspot.com", "azurewebsites.net",
+    "cloudfront.net", "s3.amazonaws.com",
+}
+
+_MAGIC = b"URLPOL1\0"
+_HEADER = struct.Struct("<8sIII16s")  # magic, slots, count, blob offset, source signature
+_SLOT = struct.Struct("<IHBx")  # key offset in blob, key length, flag
+_EMPTY = 0xFFFFFFFF
+_HOST = re.compile(r"[a-z0-9-]+(\.[a-z0-9-]+)*")
+_NETLOC = re.compile(r"[^:/\\@?#\s]+(:[0-9]{1,5})?")  # a host and optional port, nothing else
+
+
+def normalise_host(host: str) -> str:
+    """Lower-case a hostname, drop a trailing dot and IDNA-encode non-ASCII labels."""
+    host = host.strip().lower().rstrip(".")
+    if host.startswith("*."):
+        host = host[2:]
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            return ""
+    return host
+
+
+def checked_url(url: str) -> Optional[Tuple[str, str]]:
+    """(host, URL rebuilt from its checked parts), or None unless the netloc is just a host and port.
+
+    Userinfo and backslashes are rejected rather than parsed: urlparse reads
+    "http://evil.com\\@github.com/" as github.com, but browsers go to evil.com.
+    The caller should open the rebuilt URL, never the raw string.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not _NETLOC.fullmatch(parsed.netloc):
+        return None
+    host = normalise_host(parsed.hostname or "")
+    if not _HOST.fullmatch(host):
+        return None
+    port = parsed.port
+    netloc = host if port is None else f"{host}:{port}"
+    return host, urlunparse((parsed.scheme, netloc, parsed.path, parsed.params, parsed.query, parsed.fragment))
+
+
+def read_domain_list(path: str) -> List[str]:
+    """Read a domain list file, returning an empty list if it does not exist."""
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            lines = file.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+    domains = []
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if line:
+            domains.append(line)
+    return domains
+
+
+def load_public_suffixes(path: str) -> set:
+    """Load a publicsuffix.org style list (comments start with '//')."""
+    suffixes = set()
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("//"):
+                continue
+            suffixes.add(normalise_host(line) if not line.startswith(("*.", "!")) else line)
+    return suffixes
+
+
+def is_public_suffix(domain: str, suffixes: Optional[set] = None) -> bool:
+    """Return True if domain is a public suffix rather than a registrable domain."""
+    suffixes = PUBLIC_SUFFIXES if suffixes is None else suffixes
+    if "." not in domain or domain in suffixes:
+        return True
+    if "!" + domain in suffixes:
+        return False
+    return "*." + domain.split(".", 1)[1] in suffixes
+
+
+class DomainPolicy:
+    """In-memory policy: a dict from domain to ALLOW/BLOCK, probed once per label."""
+
+    def __init__(self, rules: Optional[Dict[str, int]] = None):
+        self.rules = rules or {}
+        self.rejected = []
+
+    @classmethod
+    def from_lists(cls, allow: Iterable[str] = (), block: Iterable[str] = (), public_suffixes: Optional[set] = None):
+        policy = cls()
+        for domain in allow:
+            domain = normalise_host(domain)
+            if not domain:
+                continue
+            if is_public_suffix(domain, public_suffixes):
+                policy.rejected.append(domain)
+                continue
+            policy.rules[domain] = policy.rules.get(domain, 0) | ALLOW
+        for domain in block:
+            domain = normalise_host(domain)
+            if domain:
+                policy.rules[domain] = BLOCK
+        return policy
+
+    def lookup(self, host: str) -> int:
+        """Return ALLOW, BLOCK or 0 for a normalised hostname."""
+        rules = self.rules
+        start = 0
+        while True:
+            flag = rules.get(host[start:] if start else host)
+            if flag:
+                return BLOCK if flag & BLOCK else ALLOW
+            start = host.find(".", start) + 1
+            if not start:
+                return 0
+
+    def compile(self, path: str, signature: bytes = b"") -> None:
+        """Write the policy as an open-addressed hash table that CompiledPolicy can mmap."""
+        slots = 8
+        while slots < len(self.rules) * 2:
+            slots *= 2
+        mask = slots - 1
+
+        offsets = [_EMPTY] * slots
+        lengths = [0] * slots
+        flags = [0] * slots
+        blob = bytearray()
+        for domain, flag in self.rules.items():
+            key = domain.encode("ascii")
+            index = zlib.crc32(key) & mask
+            while offsets[index] != _EMPTY:
+                index = (index + 1) & mask
+            offsets[index] = len(blob)
+            lengths[index] = len(key)
+            flags[index] = BLOCK if flag & BLOCK else ALLOW
+            blob += key
+
+        table = bytearray(_SLOT.size * slots)
+        for index in range(slots):
+            _SLOT.pack_into(table, index * _SLOT.size, offsets[index], lengths[index], flags[index])
+
+        blob_offset = _HEADER.size + len(table)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(_HEADER.pack(_MAGIC, slots, len(self.rules), blob_offset, signature.ljust(16, b"\0")[:16]))
+            file.write(table)
+            file.write(blob)
+        os.replace(tmp_path, path)
+
+
+class CompiledPolicy:
+    """Read-only policy backed by a memory-mapped file written by DomainPolicy.compile."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slots, self.count, self._blob, self.signature = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not a compiled URL policy")
+        self._mask = self.slots - 1
+
+    def lookup(self, host: str) -> int:
+        """Return ALLOW, BLOCK or 0 for a normalised hostname."""
+        mm = self._mm
+        mask = self._mask
+        blob = self._blob
+        unpack = _SLOT.unpack_from
+        key = host.encode("ascii")
+        start = 0
+        while True:
+            suffix = key[start:] if start else key
+            index = zlib.crc32(suffix) & mask
+            while True:
+                offset, length, flag = unpack(mm, _HEADER.size + index * _SLOT.size)
+                if offset == _EMPTY:
+                    break
+                if length == len(suffix) and mm[blob + offset:blob + offset + length] == suffix:
+                    return flag
+                index = (index + 1) & mask
+            start = key.find(b".", start) + 1
+            if not start:
+                return 0
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+class PolicyEngine:
+    """Allow/block decisions from inline domains plus list files, reloaded when the files change.
+
+    If cache_path is given the lists are compiled to that file and served from
+    a memory map; a cache whose signature still matches the sources is reused
+    without reading the lists at all. Reloads happen on a background thread
+    and the old policy keeps answering until the new one is ready; a replaced
+    memory map is closed once the lookups still using it have finished.
+    """
+
+    def __init__(
+        self,
+        allow: Iterable[str] = (),
+        block: Iterable[str] = (),
+        allow_files: Iterable[str] = (),
+        block_files: Iterable[str] = (),
+        cache_path: Optional[str] = None,
+        public_suffix_file: Optional[str] = None,
+        check_interval: float = 2.0,
+    ):
+        self.allow = list(allow)
+        self.block = list(block)
+        self.allow_files = list(allow_files)
+        self.block_files = list(block_files)
+        self.cache_path = cache_path
+        self.public_suffix_file = public_suffix_file
+        self.check_interval = check_interval
+
+        self._policy = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self._in_use = {}  # policy -> lookups running against it
+        self._next_check = 0.0
+        self._reloading = threading.Lock()
+        self._load(self._source_signature())
+
+    def _source_signature(self) -> bytes:
+        digest = hashlib.blake2b(digest_size=16)
+        for domain in sorted(self.allow):
+            digest.update(b"+" + domain.encode("utf-8"))
+        for domain in sorted(self.block):
+            digest.update(b"-" + domain.encode("utf-8"))
+        for path in self.allow_files + self.block_files + [self.public_suffix_file or ""]:
+            try:
+                stat = os.stat(path)
+                digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size}".encode("utf-8"))
+            except OSError:
+                digest.update(f"{path}:missing".encode("utf-8"))
+        return digest.digest()
+
+    def _load(self, signature: bytes) -> None:
+        policy = None
+        if self.cache_path and os.path.exists(self.cache_path):
+            try:
+                policy = CompiledPolicy(self.cache_path)
+                if policy.signature != signature:
+                    policy.close()
+                    policy = None
+            except (OSError, ValueError):
+                policy = None
+
+        if policy is None:
+            allow = list(self.allow)
+            for path in self.allow_files:
+                allow.extend(read_domain_list(path))
+            block = list(self.block)
+            for path in self.block_files:
+                block.extend(read_domain_list(path))
+            suffixes = load_public_suffixes(self.public_suffix_file) if self.public_suffix_file else None
+
+            policy = DomainPolicy.from_lists(allow, block, suffixes)
+            if policy.rejected:
+                print(f"[urlpolicy] Ignoring {len(policy.rejected)} public-suffix allowlist entries (e.g. {policy.rejected[0]})")
+            if self.cache_path:
+                policy.compile(self.cache_path, signature)
+                policy = CompiledPolicy(self.cache_path)
+
+        with self._lock:
+            old, self._policy = self._policy, policy
+            self._signature = signature
+            if old not in self._in_use:
+                self._close(old)
+
+    @staticmethod
+    def _close(policy) -> None:
+        if isinstance(policy, CompiledPolicy):
+            policy.close()
+
+    def _reload_if_changed(self) -> None:
+        try:
+            signature = self._source_signature()
+            if signature != self._signature:
+                self._load(signature)
+        except Exception as e:
+            print(f"[urlpolicy] Reload failed, keeping previous policy: {e}")
+        finally:
+            self._reloading.release()
+
+    def maybe_reload(self) -> None:
+        """Start a background reload if the check interval has passed and none is running."""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        if self._reloading.acquire(blocking=False):
+            threading.Thread(target=self._reload_if_changed, daemon=True).start()
+
+    def decide(self, host: str) -> int:
+        """Return ALLOW, BLOCK or 0 (not listed) for a hostname."""
+        self.maybe_reload()
+        host = normalise_host(host or "")
+        if not host:
+            return 0
+        with self._lock:
+            policy = self._policy
+            self._in_use[policy] = self._in_use.get(policy, 0) + 1
+        try:
+            return policy.lookup(host)
+        finally:
+            with self._lock:
+                count = self._in_use.pop(policy) - 1
+                if count:
+                    self._in_use[policy] = count
+                elif policy is not self._policy:
+                    self._close(policy)  # replaced by a reload while this lookup ran
+
+
+def _synthetic_domains(count: int, rng: random.Random) -> List[str]:
+    tlds = ["com", "org", "net", "io", "co.uk", "de", "com.au", "info"]
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789"
+    domains = set()
+    while len(domains) < count:
+        name = "".join(rng.choice(alphabet) for _ in range(rng.randint(5, 14)))
+        domains.add(f"{name}.{rng.choice(tlds)}")
+    return list(domains)
+
+
+def bench(max_exponent: int = 6, lookups: int = 100000) -> List[Dict]:
+    """Time building, compiling, loading and deciding for lists of 10 to 10^max_exponent domains."""
+    rng = random.Random(1234)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for exponent in range(1, max_exponent + 1):
+            size = 10 ** exponent
+            domains = _synthetic_domains(size, rng)
+            block_count = max(1, size // 10)
+            allow_path = os.path.join(tmp, "allow.txt")
+            block_path = os.path.join(tmp, "block.txt")
+            cache_path = os.path.join(tmp, "policy.cache")
+            with open(allow_path, "w") as file:
+                file.write("\n".join(domains[block_count:]))
+            with open(block_path, "w") as file:
+                file.write("\n".join(domains[:block_count]))
+
+            start = time.perf_counter()
+            policy = DomainPolicy.from_lists(read_domain_list(allow_path), read_domain_list(block_path))
+            build_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            policy.compile(cache_path)
+            compile_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            compiled = CompiledPolicy(cache_path)
+            load_s = time.perf_counter() - start
+
+            hosts = []
+            for _ in range(lookups):
+                if rng.random() < 0.5:
+                    hosts.append("www." + rng.choice(domains))
+                else:
+                    hosts.append(f"miss{rng.randint(0, 10 ** 9)}.example.com")
+
+            timings = {}
+            for label, lookup in (("dict", policy.lookup), ("mmap", compiled.lookup)):
+                start = time.perf_counter()
+                for host in hosts:
+                    lookup(host)
+                timings[label] = (time.perf_counter() - start) / lookups * 1e6
+            compiled.close()
+
+            results.append({
+                "domains": size,
+                "build_s": build_s,
+                "compile_s": compile_s,
+                "mmap_load_ms": load_s * 1000,
+                "dict_decide_us": timings["dict"],
+                "mmap_decide_us": timings["mmap"],
+                "cache_bytes": os.path.getsize(cache_path),
+            })
+            row = results[-1]
+            print(
+                f"{size:>9} domains | build {row['build_s']:.3f}s | compile {row['compile_s']:.3f}s | "
+                f"mmap load {row['mmap_load_ms']:.3f}ms | decide dict {row['dict_decide_us']:.2f}us "
+                f"mmap {row['mmap_decide_us']:.2f}us | cache {row['cache_bytes'] / 1024:.0f} KiB"
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile or benchmark URL allow/block policies")
+    parser.add_argument("--compile", nargs="*", metavar="ALLOW_FILE", help="Allowlist files to compile")
+    parser.add_argument("--block", nargs="*", metavar="BLOCK_FILE", help="Blocklist files to compile")
+    parser.add_argument("--public-suffixes", help="publicsuffix.org list to use instead of the built-in set")
+    parser.add_argument("-o", "--output", default="url_policy.cache", help="Compiled policy path")
+    parser.add_argument("--check", nargs="*", metavar="HOST", help="Print the decision for each host (uses the existing cache unless compiling)")
+    parser.add_argument("--bench", action="store_true", help="Benchmark list sizes from 10 to 10^6")
+    parser.add_argument("--max-exponent", type=int, default=6, help="Largest benchmark size as a power of 10")
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.max_exponent)
+        return
+
+    if args.compile is not None or args.block is not None:
+        engine = PolicyEngine(
+            allow_files=args.compile or [],
+            block_files=args.block or [],
+            cache_path=args.output,
+            public_suffix_file=args.public_suffixes,
+        )
+        policy = engine._policy
+        print(f"Compiled {policy.count} entries to {args.output}")
+    elif args.check is not None:
+        if not os.path.exists(args.output):
+            parser.error(f"{args.output} does not exist; build it with --compile/--block first")
+        policy = CompiledPolicy(args.output)
+    else:
+        parser.print_help()
+        return
+    for host in args.check or []:
+        normalised = normalise_host(host)
+        decision = policy.lookup(normalised) if normalised else 0
+        print(f"{host}: {'allow' if decision == ALLOW else 'block' if decision == BLOCK else 'not listed'}")
+
+
+if __name__ == "__main__":
+    main()